@@ -1,29 +1,32 @@
 import os
 import uuid  
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, redirect, url_for, flash, request, send_from_directory, abort, send_file
+from flask import Flask, render_template, redirect, url_for, flash, request, send_from_directory, abort, send_file, jsonify, Response
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
+import click
+from flask.cli import AppGroup
 
-from docx import Document as DocxDoc
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 from io import BytesIO
 
 from config import Config
-from models import db, User, Document, Knowledge, Collection, CollectionItem, RecentlyViewed
+from models import db, User, Document, Knowledge, Collection, CollectionItem, RecentlyViewed, Author, DocumentSignature, document_author
 from forms import RegistrationForm, LoginForm, DocumentForm, DocumentEditForm
-from utils import init_search_index, search_fulltext, index_document, delete_document_from_index, backup_database
+from utils import init_search_index, search_fulltext, backup_database, extract_text
+from index_maintenance import merge_segments, reconcile_index, recover_stale_lock
+from index_queue import IndexQueue
+from search_cache import SearchCache, cache_key, index_generation
+from suggest import Suggester
+from dedup import register_document, forget_document, similar_documents, collapse_duplicates
+import bulk
+from local_cache import LocalCache, FragmentCacheExtension
+from metrics import registry, init_metrics
 
 def create_app(config_class=Config):
     # Запускаємо фласк і підтягуємо конфіги
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    # Робимо папки для файлів і бекапів, якщо їх ще немає
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs('backups', exist_ok=True)
-    os.makedirs(app.instance_path, exist_ok=True)
-
     # Підключаємо базу і захист форм
     db.init_app(app)
     from flask_wtf.csrf import CSRFProtect
@@ -36,42 +39,86 @@ def create_app(config_class=Config):
     login_manager.login_message = 'Будь ласка, увійдіть в систему'
     login_manager.login_message_category = 'info'
 
+    # Кеш у пам'яті процесу для юзерів, рідко змінних списків і шматків HTML ({% cache %})
+    local_cache = LocalCache(ttl=app.config['LOCAL_CACHE_TTL'])
+    app.extensions['local_cache'] = local_cache
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def detached_user(user_id):
+        user = db.session.get(User, user_id)
+        # Відв'язуємо від сесії, щоб коміти в інших запитах не скидали його атрибути
+        if user: db.session.expunge(user)
+        return user
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
-
-    # Ця штука потрібна, щоб на будь-якій сторінці показувати "Нещодавно переглянуті"
+        # Без походу в БД на кожен запит; скидається в toggle_user
+        return local_cache.get_or_set(('user', int(user_id)), lambda: detached_user(int(user_id)))
+
+    def recent_views(user_id):
+        # Беремо останні 20 переглядів, фільтруємо дублікати, залишаємо 10 унікальних
+        rows = db.session.query(RecentlyViewed.document_id, Document.title, Document.authors, Document.year)\
+            .join(Document, Document.id == RecentlyViewed.document_id)\
+            .filter(RecentlyViewed.user_id == user_id)\
+            .order_by(RecentlyViewed.viewed_at.desc()).limit(20).all()
+        unique_recent = []
+        seen = set()
+        for doc_id, title, authors, year in rows:
+            if doc_id not in seen:
+                unique_recent.append(dict(id=doc_id, title=title, authors=authors, year=year))
+                seen.add(doc_id)
+            if len(unique_recent) >= 10: break
+        return unique_recent
+
+    # Ця штука потрібна, щоб на будь-якій сторінці показувати "Нещодавно переглянуті".
+    # Віддаємо функцію, а не список: рахуємо тільки там, де шаблон її справді викликає
     @app.context_processor
+    @registry.timed('context_processor_seconds', processor='inject_recent')
     def inject_recent():
         if current_user.is_authenticated:
-            # Беремо останні 20 переглядів, фільтруємо дублікати, залишаємо 10 унікальних
-            recent_views = RecentlyViewed.query.filter_by(user_id=current_user.id)\
-                .order_by(RecentlyViewed.viewed_at.desc()).limit(20).all()
-            unique_recent = []
-            seen = set()
-            for view in recent_views:
-                if view.document_id not in seen:
-                    unique_recent.append(view.document)
-                    seen.add(view.document_id)
-                if len(unique_recent) >= 10: break
-            return dict(recently_viewed_docs=unique_recent)
-        return dict(recently_viewed_docs=[])
-
-    # При старті створюємо таблиці і адміна, якщо його ще нема
+            user_id = current_user.id
+            return dict(recently_viewed=lambda: local_cache.get_or_set(('recent_views', user_id),
+                                                                       lambda: recent_views(user_id)))
+        return dict(recently_viewed=lambda: [])
+
+    def documents_changed():
+        # Назви документів є в кількох кешованих списках — скидаємо всі
+        local_cache.invalidate('recent_uploads')
+        local_cache.invalidate('recent_views')
+        local_cache.invalidate('my_lists')
+
+    # Таймери запитів, SQL і шаблонів для /metrics і логів.
+    # Таблиці, індекс і адміна create_app не чіпає — це робить `flask init`
     with app.app_context():
-        db.create_all()
-        init_search_index()
-        if not User.query.filter_by(email='admin@example.com').first():
-            admin = User(email='admin@example.com', name='Адміністратор системи', role='admin', is_active=True)
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
+        init_metrics(app, db.engine)
+
+    # Усі зміни індексу йдуть через чергу з одним писарем (див. index_queue.py)
+    index_queue = IndexQueue(app.config['WHOOSH_BASE'], max_delay=app.config['INDEX_COMMIT_DELAY'],
+                             max_batch=app.config['INDEX_COMMIT_BATCH'])
+    app.extensions['index_queue'] = index_queue
+    # Кеш результатів пошуку, скидається сам зі зміною генерації індексу
+    search_cache = SearchCache(app.config['WHOOSH_BASE'], max_entries=app.config['SEARCH_CACHE_SIZE'])
+    app.extensions['search_cache'] = search_cache
+    # Підказки для рядка пошуку, перебудовуються при нових комітах в індекс
+    suggester = Suggester(app.config['WHOOSH_BASE'])
+    app.extensions['suggester'] = suggester
+
+    def sync_index(seq):
+        # Чекаємо, поки зміна стане видимою в пошуку, щоб юзер одразу бачив свій документ
+        mode = app.config['INDEX_WRITER']
+        if mode == 'inline':
+            index_queue.drain_all()
+            return True
+        if mode == 'thread': index_queue.start()
+        return index_queue.wait_for(seq, app.config['INDEX_VISIBILITY_TIMEOUT'])
 
     # === Сторінки входу/реєстрації ===
     @app.route('/')
     def index():
         # На головній показуємо останні завантажені документи
-        recent_uploads = Document.query.order_by(Document.uploaded_at.desc()).limit(10).all()
+        recent_uploads = local_cache.get_or_set(('recent_uploads',), lambda: [
+            dict(id=d.id, title=d.title, authors=d.authors, year=d.year, uploaded_at=d.uploaded_at)
+            for d in Document.query.order_by(Document.uploaded_at.desc()).limit(10)])
         return render_template('index.html', recent=recent_uploads)
 
     @app.route('/register', methods=['GET', 'POST'])
@@ -123,6 +170,7 @@ def create_app(config_class=Config):
                 return redirect(request.url)
             
             # Зберігаємо файл з унікальним ім'ям, щоб не було конфліктів
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
             unique_filename = str(uuid.uuid4()) + ext
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
             f.save(filepath)
@@ -134,11 +182,20 @@ def create_app(config_class=Config):
                 uploaded_by=current_user.id
             )
             db.session.add(doc)
+            Author.refresh_counts(doc.set_authors(form.authors.data))
+            # Текст витягуємо один раз: для пошуку дублікатів і для індексу
+            text = extract_text(filepath)
+            duplicates = register_document(doc.id, text, app.config['DUPLICATE_THRESHOLD'])
             db.session.commit()
             
             # Додаємо текст документа в пошуковий індекс
-            index_document(doc.id, filepath)
+            sync_index(index_queue.add(doc, filepath, content=text))
+            documents_changed()
             flash('Документ завантажено!', 'success')
+            if duplicates:
+                original = db.session.get(Document, duplicates[0][0])
+                flash(f'Схоже, це версія вже наявного документа «{original.title}» '
+                      f'(схожість {duplicates[0][1]:.0%})', 'warning')
             return redirect(url_for('document_list'))
         return render_template('document/upload.html', form=form)
 
@@ -152,20 +209,27 @@ def create_app(config_class=Config):
         form = DocumentEditForm(obj=doc)
         if form.validate_on_submit():
             form.populate_obj(doc)
+            text = None
             # Якщо завантажили новий файл — замінюємо старий
             if form.file.data:
                 f = form.file.data
                 ext = os.path.splitext(f.filename)[1].lower()
                 new_filename = str(uuid.uuid4()) + ext
+                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
                 f.save(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
                 try: os.remove(os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename))
                 except: pass
                 doc.stored_filename = new_filename
                 doc.original_filename = f.filename
+                # Новий файл — новий підпис для пошуку дублікатів
+                text = extract_text(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
+                register_document(doc.id, text, app.config['DUPLICATE_THRESHOLD'])
             
+            Author.refresh_counts(doc.set_authors(doc.authors))
             db.session.commit()
             # Оновлюємо пошуковий індекс
-            index_document(doc.id, os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename))
+            sync_index(index_queue.add(doc, os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename), content=text))
+            documents_changed()
             flash('Документ оновлено', 'success')
             return redirect(url_for('document_detail', doc_id=doc.id))
         return render_template('document/upload.html', form=form, title="Редагування")
@@ -177,15 +241,23 @@ def create_app(config_class=Config):
         if current_user.role != 'admin' and doc.uploaded_by != current_user.id: abort(403)
         
         # Видаляємо з пошуку, з диска і з бази
-        delete_document_from_index(doc.id)
+        sync_index(index_queue.delete(doc.id))
         try: os.remove(os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename))
         except: pass
         
-        # Чистимо пов'язані дані (знання, історію)
-        Knowledge.query.filter_by(document_id=doc.id).delete()
-        RecentlyViewed.query.filter_by(document_id=doc.id).delete()
-        db.session.delete(doc)
+        # Чистимо пов'язані дані (знання разом з місцем у колекціях, історію, авторів)
+        # масовими DELETE, а не через ORM по одному рядку
+        notes = db.select(Knowledge.id).where(Knowledge.document_id == doc.id)
+        CollectionItem.query.filter(CollectionItem.knowledge_id.in_(notes)).delete(synchronize_session=False)
+        Knowledge.query.filter_by(document_id=doc.id).delete(synchronize_session=False)
+        RecentlyViewed.query.filter_by(document_id=doc.id).delete(synchronize_session=False)
+        forget_document(doc.id)
+        author_ids = [a.id for a in doc.author_list]
+        db.session.execute(document_author.delete().where(document_author.c.document_id == doc.id))
+        Document.query.filter_by(id=doc.id).delete()
+        Author.refresh_counts(author_ids)
         db.session.commit()
+        documents_changed()
         flash('Документ видалено', 'success')
         return redirect(url_for('document_list'))
 
@@ -194,27 +266,75 @@ def create_app(config_class=Config):
     def document_list():
         # Отримуємо параметри для пошуку та фільтрації
         query = request.args.get('q', '').strip()
-        author = request.args.get('author', '')
+        author = request.args.get('author', '').strip()
+        author_id = request.args.get('author_id', type=int)
         year_from = request.args.get('year_from', type=int)
         year_to = request.args.get('year_to', type=int)
         doc_type = request.args.get('type', '')
         show_my = request.args.get('show_my')
+        cluster = request.args.get('cluster', type=int)
+        collapse = request.args.get('collapse') == '1'
+
+        filters = dict(author=author, author_id=author_id, year_from=year_from, year_to=year_to, type=doc_type,
+                       user=current_user.id if show_my == '1' else None, cluster=cluster)
 
-        docs = Document.query
-        # Якщо є пошуковий запит — шукаємо по тексту
+        # Повнотекстові запити кешуємо до наступного коміту в індекс
+        documents = None
         if query:
-            ids = search_fulltext(query)
-            docs = docs.filter(Document.id.in_(ids)) if ids else docs.filter(False)
-        
-        # Застосовуємо фільтри
-        if author: docs = docs.filter(Document.authors.ilike(f'%{author}%'))
-        if year_from: docs = docs.filter(Document.year >= year_from)
-        if year_to: docs = docs.filter(Document.year <= year_to)
-        if doc_type: docs = docs.filter_by(doc_type=doc_type)
-        if show_my == '1': docs = docs.filter_by(uploaded_by=current_user.id)
-        
-        documents = docs.order_by(Document.uploaded_at.desc()).all()
-        return render_template('document/list.html', documents=documents)
+            generation = index_generation(app.config['WHOOSH_BASE'])
+            key = cache_key(query, filters)
+            cached_ids = search_cache.get(key, generation)
+            if cached_ids is not None:
+                documents = Document.query.filter(Document.id.in_(cached_ids))\
+                    .order_by(Document.uploaded_at.desc()).all() if cached_ids else []
+
+        if documents is None:
+            docs = Document.query
+            # Якщо є пошуковий запит — шукаємо по тексту
+            if query:
+                ids = search_fulltext(query, app.config['WHOOSH_BASE'], cache=search_cache)
+                docs = docs.filter(Document.id.in_(ids)) if ids else docs.filter(False)
+            
+            # Застосовуємо фільтри
+            if author: docs = docs.filter(Document.author_list.any(Author.prefix_filter(author)))
+            if author_id: docs = docs.filter(Document.author_list.any(Author.id == author_id))
+            if year_from: docs = docs.filter(Document.year >= year_from)
+            if year_to: docs = docs.filter(Document.year <= year_to)
+            if doc_type: docs = docs.filter_by(doc_type=doc_type)
+            if show_my == '1': docs = docs.filter_by(uploaded_by=current_user.id)
+            # Усі версії одного документа (посилання "ще N версій" у згорнутому списку)
+            if cluster: docs = docs.filter(Document.id.in_(
+                db.session.query(DocumentSignature.document_id).filter_by(cluster_id=cluster)))
+            
+            documents = docs.order_by(Document.uploaded_at.desc()).all()
+            if query: search_cache.put(key, generation, [d.id for d in documents])
+
+        # Якщо нічого не знайшли — пропонуємо виправлений запит
+        did_you_mean = suggester.did_you_mean(query) if query and not documents else None
+        # Згортаємо дублікати вже після кешу, щоб не множити записи в ньому
+        hidden_duplicates, clusters = {}, {}
+        if collapse: documents, hidden_duplicates, clusters = collapse_duplicates(documents)
+        return render_template('document/list.html', documents=documents, did_you_mean=did_you_mean,
+                               hidden_duplicates=hidden_duplicates, clusters=clusters)
+
+    @app.route('/search/suggest')
+    @login_required
+    def search_suggest():
+        # Підказки за префіксом для рядка пошуку і фільтра авторів
+        prefix = request.args.get('q', '')
+        field = request.args.get('field', 'title')
+        limit = min(request.args.get('limit', 8, type=int), 20)
+        return jsonify(suggestions=suggester.suggest(prefix, field, limit))
+
+    @app.route('/authors')
+    @login_required
+    def author_list():
+        # Каталог авторів з готовими лічильниками документів
+        q = request.args.get('q', '').strip()
+        authors = Author.query
+        if q: authors = authors.filter(Author.prefix_filter(q))
+        authors = authors.order_by(Author.sort_key).all()
+        return render_template('author/list.html', authors=authors)
 
     @app.route('/document/<int:doc_id>')
     @login_required
@@ -224,11 +344,16 @@ def create_app(config_class=Config):
         view = RecentlyViewed(user_id=current_user.id, document_id=doc_id)
         db.session.add(view)
         db.session.commit()
+        local_cache.invalidate('recent_views', current_user.id)
         
         knowledges = Knowledge.query.filter_by(document_id=doc_id, user_id=current_user.id).all()
+        # Майже-дублікати з LSH-індексу: інші версії того ж тексту
+        similar = similar_documents(doc_id, app.config['DUPLICATE_THRESHOLD'])
+        similar_docs = {d.id: d for d in Document.query.filter(Document.id.in_([i for i, _ in similar]))} if similar else {}
+        similar = [(similar_docs[i], score) for i, score in similar if i in similar_docs]
         
         # Сам файл будемо показувати через JS на клієнті
-        return render_template('document/detail.html', doc=doc, knowledges=knowledges)
+        return render_template('document/detail.html', doc=doc, knowledges=knowledges, similar=similar)
 
     # Цей маршрут віддає файл, щоб його можна було переглянути в браузері
     @app.route('/document/<int:doc_id>/view')
@@ -257,6 +382,7 @@ def create_app(config_class=Config):
             k = Knowledge(document_id=doc_id, user_id=current_user.id, text=text, note=note, tags=tags)
             db.session.add(k)
             db.session.commit()
+            local_cache.invalidate('my_lists', current_user.id)
             flash('Збережено!', 'success')
         return redirect(url_for('document_detail', doc_id=doc_id))
 
@@ -287,58 +413,49 @@ def create_app(config_class=Config):
         if k.user_id != current_user.id: abort(403)
         db.session.delete(k)
         db.session.commit()
+        local_cache.invalidate('my_lists', current_user.id)
         flash('Видалено', 'success')
         next_page = request.args.get('next')
         if next_page: return redirect(next_page)
         return redirect(url_for('my_knowledge'))
 
+    BULK_MESSAGES = {
+        'add_to_collection': 'Додано {} записів',
+        'remove_from_collection': 'Прибрано з колекції: {}',
+        'move_to_collection': 'Перенесено записів: {}',
+        'retag': 'Оновлено теги: {}',
+        'delete': 'Видалено записів: {}',
+    }
+
+    def run_bulk_action(action, form):
+        # Одна транзакція на всю дію; повертає кількість змінених записів або None для невідомої дії
+        ids = [int(x) for x in form.getlist('knowledge_ids') if x.isdigit()]
+        collection_id = form.get('collection_id', type=int)
+        if action == 'add_to_collection': count = bulk.add_to_collection(current_user.id, collection_id, ids)
+        elif action == 'remove_from_collection': count = bulk.remove_from_collection(current_user.id, collection_id, ids)
+        elif action == 'move_to_collection':
+            count = bulk.move_between_collections(current_user.id, form.get('from_collection_id', type=int), collection_id, ids)
+        elif action == 'retag': count = bulk.retag(current_user.id, ids, form.get('tags', ''))
+        elif action == 'delete': count = bulk.delete_notes(current_user.id, ids)
+        else: return None
+        db.session.commit()
+        local_cache.invalidate('my_lists', current_user.id)
+        return count
+
+    @app.route('/knowledge/bulk', methods=['POST'])
+    @login_required
+    def bulk_knowledge():
+        # Те саме, що кнопки на сторінці нотаток, але відповідь — JSON з кількістю
+        action = request.form.get('action')
+        count = run_bulk_action(action, request.form)
+        if count is None: return jsonify(error='Невідома дія'), 400
+        return jsonify(action=action, count=count)
+
     # Головна сторінка для роботи з нотатками і колекціями
     @app.route('/my/knowledge', methods=['GET', 'POST'])
     @login_required
     def my_knowledge():
-        # Збираємо купу фільтрів з GET-запиту
-        q = request.args.get('q', '').strip()
-        tag = request.args.get('tag', '').strip()
-        filter_doc = request.args.get('filter_doc', type=int)
-        filter_col = request.args.get('filter_col', type=int)
-        sort_by = request.args.get('sort_by', 'date_desc')
-
-        col_q = request.args.get('col_q', '').strip()
-        col_item_q = request.args.get('col_item_q', '').strip()
-        col_sort = request.args.get('col_sort', 'name_asc')
-        active_tab = request.args.get('tab', 'all')
-
-        # Будуємо запит на нотатки
-        query = Knowledge.query.filter_by(user_id=current_user.id)
-        if q: query = query.filter((Knowledge.text.ilike(f'%{q}%')) | (Knowledge.note.ilike(f'%{q}%')))
-        if tag: query = query.filter(Knowledge.tags.ilike(f'%{tag}%'))
-        if filter_doc: query = query.filter_by(document_id=filter_doc)
-        if filter_col: query = query.join(Knowledge.collection_items).filter(CollectionItem.collection_id == filter_col)
-
-        # Сортуємо нотатки
-        if sort_by == 'doc_title': query = query.join(Document).order_by(Document.title.asc())
-        elif sort_by == 'date_asc': query = query.order_by(Knowledge.created_at.asc())
-        else: query = query.order_by(Knowledge.created_at.desc())
-        knowledges = query.all()
-
-        # Тепер розбираємося з колекціями
-        c_query = Collection.query.filter_by(user_id=current_user.id)
-        if col_q: c_query = c_query.filter(Collection.name.ilike(f'%{col_q}%'))
-        if col_item_q: c_query = c_query.join(Collection.items).join(CollectionItem.knowledge)\
-                             .filter((Knowledge.text.ilike(f'%{col_item_q}%')) | (Knowledge.note.ilike(f'%{col_item_q}%')))
-        
-        collections_list = c_query.all()
-        # Сортування колекцій робимо в пайтоні
-        if col_sort == 'count_desc': collections_list.sort(key=lambda c: len(c.items), reverse=True)
-        elif col_sort == 'count_asc': collections_list.sort(key=lambda c: len(c.items), reverse=False)
-        elif col_sort == 'name_desc': collections_list.sort(key=lambda c: c.name.lower(), reverse=True)
-        else: collections_list.sort(key=lambda c: c.name.lower())
-
-        # Для випадаючих списків у фільтрах
-        all_docs = Document.query.join(Knowledge).filter(Knowledge.user_id==current_user.id).distinct().all()
-        all_cols = Collection.query.filter_by(user_id=current_user.id).order_by(Collection.name).all()
-
-        # Обробка масових дій (експорт або додавання в колекцію)
+        # Масові дії обробляємо до побудови списків, яким вони не потрібні
         if request.method == 'POST':
             action = request.form.get('action')
             
@@ -364,7 +481,9 @@ def create_app(config_class=Config):
                 k_map = {k.id: k for k in k_objects}
                 sorted_knowledge = [k_map[fid] for fid in final_ids if fid in k_map]
 
-                # Формуємо документ
+                # Формуємо документ (python-docx вантажимо тільки тут)
+                from docx import Document as DocxDoc
+                from docx.enum.text import WD_ALIGN_PARAGRAPH
                 doc = DocxDoc()
                 doc.add_heading('Експортовані конспекти', 0).alignment = WD_ALIGN_PARAGRAPH.CENTER
                 for i, k in enumerate(sorted_knowledge, 1):
@@ -382,24 +501,60 @@ def create_app(config_class=Config):
                 buffer.seek(0)
                 return send_file(buffer, as_attachment=True, download_name=f"export_{datetime.now().strftime('%H-%M')}.docx", mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
 
-            # Додавання вибраного до колекції
-            elif action == 'add_to_collection':
-                collection_id = request.form.get('collection_id')
-                selected_ids = request.form.getlist('knowledge_ids')
-                if collection_id and selected_ids:
-                    coll = Collection.query.get(collection_id)
-                    if coll and coll.user_id == current_user.id:
-                        count = 0
-                        for kid in selected_ids:
-                            kn = Knowledge.query.get(int(kid))
-                            exists = CollectionItem.query.filter_by(collection_id=coll.id, knowledge_id=kn.id).first()
-                            if kn and kn.user_id == current_user.id and not exists:
-                                item = CollectionItem(collection=coll, knowledge=kn)
-                                db.session.add(item)
-                                count += 1
-                        db.session.commit()
-                        flash(f'Додано {count} записів', 'success')
-                return redirect(url_for('my_knowledge'))
+            # Решта масових дій — по одному SQL-запиту на всю вибірку (див. bulk.py)
+            count = run_bulk_action(action, request.form)
+            if count is not None: flash(BULK_MESSAGES[action].format(count), 'success')
+            return redirect(url_for('my_knowledge'))
+
+        # Збираємо купу фільтрів з GET-запиту
+        q = request.args.get('q', '').strip()
+        tag = request.args.get('tag', '').strip()
+        filter_doc = request.args.get('filter_doc', type=int)
+        filter_col = request.args.get('filter_col', type=int)
+        sort_by = request.args.get('sort_by', 'date_desc')
+
+        col_q = request.args.get('col_q', '').strip()
+        col_item_q = request.args.get('col_item_q', '').strip()
+        col_sort = request.args.get('col_sort', 'name_asc')
+        active_tab = request.args.get('tab', 'all')
+
+        # Будуємо запит на нотатки; документ і колекції шаблон бере для кожної — вантажимо наперед
+        query = Knowledge.query.filter_by(user_id=current_user.id).options(
+            db.joinedload(Knowledge.document),
+            db.selectinload(Knowledge.collection_items).joinedload(CollectionItem.collection))
+        if q: query = query.filter((Knowledge.text.ilike(f'%{q}%')) | (Knowledge.note.ilike(f'%{q}%')))
+        if tag: query = query.filter(Knowledge.tags.ilike(f'%{tag}%'))
+        if filter_doc: query = query.filter_by(document_id=filter_doc)
+        if filter_col: query = query.join(Knowledge.collection_items).filter(CollectionItem.collection_id == filter_col)
+
+        # Сортуємо нотатки
+        if sort_by == 'doc_title': query = query.join(Document).order_by(Document.title.asc())
+        elif sort_by == 'date_asc': query = query.order_by(Knowledge.created_at.asc())
+        else: query = query.order_by(Knowledge.created_at.desc())
+        knowledges = query.all()
+
+        # Тепер розбираємося з колекціями
+        c_query = Collection.query.filter_by(user_id=current_user.id).options(
+            db.selectinload(Collection.items).joinedload(CollectionItem.knowledge).joinedload(Knowledge.document))
+        if col_q: c_query = c_query.filter(Collection.name.ilike(f'%{col_q}%'))
+        if col_item_q: c_query = c_query.join(Collection.items).join(CollectionItem.knowledge)\
+                             .filter((Knowledge.text.ilike(f'%{col_item_q}%')) | (Knowledge.note.ilike(f'%{col_item_q}%')))
+        
+        collections_list = c_query.all()
+        # Сортування колекцій робимо в пайтоні
+        if col_sort == 'count_desc': collections_list.sort(key=lambda c: len(c.items), reverse=True)
+        elif col_sort == 'count_asc': collections_list.sort(key=lambda c: len(c.items), reverse=False)
+        elif col_sort == 'name_desc': collections_list.sort(key=lambda c: c.name.lower(), reverse=True)
+        else: collections_list.sort(key=lambda c: c.name.lower())
+
+        # Для випадаючих списків у фільтрах (кеш скидається при змінах нотаток і колекцій)
+        user_id = current_user.id
+        all_docs = local_cache.get_or_set(('my_lists', user_id, 'docs'), lambda: [
+            dict(id=d_id, title=title) for d_id, title in db.session.query(Document.id, Document.title)
+            .join(Knowledge).filter(Knowledge.user_id == user_id).distinct()])
+        all_cols = local_cache.get_or_set(('my_lists', user_id, 'cols'), lambda: [
+            dict(id=c_id, name=name) for c_id, name in db.session.query(Collection.id, Collection.name)
+            .filter_by(user_id=user_id).order_by(Collection.name)])
 
         return render_template('knowledge/list.html', knowledges=knowledges, collections=collections_list, all_docs=all_docs, all_cols=all_cols, active_tab=active_tab)
 
@@ -412,6 +567,7 @@ def create_app(config_class=Config):
             if not Collection.query.filter_by(name=name, user_id=current_user.id).first():
                 db.session.add(Collection(name=name, user_id=current_user.id))
                 db.session.commit()
+                local_cache.invalidate('my_lists', current_user.id)
             else: flash('Вже існує', 'warning')
         return redirect(url_for('my_knowledge', tab='collections'))
 
@@ -420,8 +576,11 @@ def create_app(config_class=Config):
     def delete_collection(c_id):
         c = Collection.query.get_or_404(c_id)
         if c.user_id != current_user.id: abort(403)
-        db.session.delete(c)
+        # Елементи видаляємо одним запитом, а не каскадом ORM по кожному
+        CollectionItem.query.filter_by(collection_id=c.id).delete(synchronize_session=False)
+        Collection.query.filter_by(id=c.id).delete()
         db.session.commit()
+        local_cache.invalidate('my_lists', current_user.id)
         return redirect(url_for('my_knowledge', tab='collections'))
     
     @app.route('/collection/<int:c_id>/rename', methods=['POST'])
@@ -431,6 +590,7 @@ def create_app(config_class=Config):
         if c.user_id != current_user.id: abort(403)
         c.name = request.form.get('name', c.name)
         db.session.commit()
+        local_cache.invalidate('my_lists', current_user.id)
         return redirect(url_for('my_knowledge', tab='collections'))
 
     @app.route('/collection/<int:c_id>/remove_item/<int:k_id>', methods=['POST'])
@@ -450,6 +610,8 @@ def create_app(config_class=Config):
         # Експорт цілої колекції в DOCX
         c = Collection.query.get_or_404(c_id)
         if c.user_id != current_user.id: abort(403)
+        from docx import Document as DocxDoc
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
         doc = DocxDoc()
         doc.add_heading(f'Колекція: {c.name}', 0).alignment = WD_ALIGN_PARAGRAPH.CENTER
         for i, item in enumerate(c.items, 1):
@@ -484,6 +646,7 @@ def create_app(config_class=Config):
         user = User.query.get_or_404(user_id)
         user.is_active = not user.is_active
         db.session.commit()
+        local_cache.invalidate('user', user_id)
         return redirect(url_for('admin_users'))
 
     @app.route('/admin/backup')
@@ -494,8 +657,133 @@ def create_app(config_class=Config):
         flash(f'Бекап: {os.path.basename(path)}', 'success')
         return redirect(url_for('index'))
 
+    @app.route('/metrics')
+    @login_required
+    def metrics():
+        if current_user.role != 'admin': abort(403)
+        # Стан кешу і черги знімаємо в момент скрейпу
+        registry.set('search_cache_entries', search_cache.stats()['entries'])
+        registry.set('index_queue_pending', index_queue.pending()[0])
+        registry.set('index_generation', index_generation(app.config['WHOOSH_BASE']))
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    # === Початкове налаштування (flask init) ===
+    @app.cli.command('init')
+    def init_command():
+        # Один раз при розгортанні, а не в кожному воркері
+        init_app_data(app)
+        click.echo('Таблиці, папки і пошуковий індекс готові')
+
+    # === Обслуговування пошукового індексу (flask index ...) ===
+    # Злиття можна ставити в cron: `flask index merge` раз на ніч
+    index_cli = AppGroup('index', help='Обслуговування пошукового індексу')
+
+    @index_cli.command('merge')
+    @click.option('--small', is_flag=True, help='Зливати тільки дрібні сегменти')
+    def index_merge(small):
+        result = merge_segments(app.config['WHOOSH_BASE'], optimize=not small,
+                                lease_seconds=app.config['WHOOSH_LOCK_LEASE'])
+        if result is None:
+            click.echo('Злиття вже виконується або індексу немає')
+        else:
+            click.echo(f'Сегментів: {result[0]} -> {result[1]}')
+
+    @index_cli.command('reconcile')
+    @click.option('--repair', is_flag=True, help='Доіндексувати пропущені та видалити зайві записи')
+    def index_reconcile(repair):
+        report = reconcile_index(app.config['WHOOSH_BASE'], app.config['UPLOAD_FOLDER'], repair=repair)
+        click.echo(f"Немає в індексі: {report['missing']}")
+        click.echo(f"Немає в БД: {report['orphans']}")
+        if repair: click.echo('Виправлено')
+
+    @index_cli.command('unlock')
+    def index_unlock():
+        if recover_stale_lock(app.config['WHOOSH_BASE'], app.config['WHOOSH_LOCK_LEASE']):
+            click.echo('Покинутий лок знято')
+        else:
+            click.echo('Лок вільний або ще тримається живим процесом')
+
+    @index_cli.command('cache-stats')
+    def index_cache_stats():
+        # Влучання рахує кожен воркер у себе — їх видно на /metrics (search_cache_hits_total)
+        stats = search_cache.stats()
+        click.echo(f"Записів у кеші: {stats['entries']}")
+
+    @index_cli.command('worker')
+    def index_worker():
+        # Окремий процес-писар для INDEX_WRITER = 'external'
+        click.echo('Писар індексу запущено, Ctrl+C для зупинки')
+        try:
+            index_queue.run()
+        except KeyboardInterrupt:
+            index_queue.drain_all()
+
+    app.cli.add_command(index_cli)
+
+    # === Міграція авторів (flask authors backfill) ===
+    authors_cli = AppGroup('authors', help='Нормалізовані автори документів')
+
+    @authors_cli.command('backfill')
+    @click.option('--all', 'all_docs', is_flag=True, help='Перерозібрати і документи, що вже мають авторів')
+    def authors_backfill(all_docs):
+        # Розбираємо вільний текст authors у вже наявних документах
+        db.create_all()
+        touched = set()
+        docs = Document.query if all_docs else Document.query.filter(~Document.author_list.any())
+        for doc in docs:
+            touched |= doc.set_authors(doc.authors)
+        Author.refresh_counts(touched)
+        Author.ensure_tokens()
+        db.session.commit()
+        click.echo(f'Авторів: {Author.query.count()}')
+
+    @authors_cli.command('recount')
+    def authors_recount():
+        Author.refresh_counts([a.id for a in Author.query])
+        db.session.commit()
+        click.echo('Лічильники оновлено')
+
+    app.cli.add_command(authors_cli)
+
+    # === Підписи для пошуку дублікатів (flask dedup backfill) ===
+    dedup_cli = AppGroup('dedup', help='Пошук майже-дублікатів документів')
+
+    @dedup_cli.command('backfill')
+    def dedup_backfill():
+        # Рахуємо підписи для документів, завантажених до появи пошуку дублікатів
+        db.create_all()
+        signed = db.session.query(DocumentSignature.document_id)
+        count = 0
+        for doc in Document.query.filter(~Document.id.in_(signed)).order_by(Document.id):
+            register_document(doc.id, extract_text(os.path.join(app.config['UPLOAD_FOLDER'], doc.stored_filename)),
+                              app.config['DUPLICATE_THRESHOLD'])
+            db.session.commit()
+            count += 1
+        clusters = db.session.query(db.func.count(db.distinct(DocumentSignature.cluster_id))).scalar()
+        click.echo(f'Оброблено документів: {count}, кластерів: {clusters}')
+
+    app.cli.add_command(dedup_cli)
+
     return app
 
+def init_app_data(app):
+    # Створюємо папки, таблиці, пошуковий індекс і адміна, якщо його ще нема
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs('backups', exist_ok=True)
+    os.makedirs(app.instance_path, exist_ok=True)
+    with app.app_context():
+        db.create_all()
+        init_search_index(app.config['WHOOSH_BASE'], app.config['WHOOSH_LOCK_LEASE'])
+        bulk.ensure_unique_items()
+        Author.ensure_tokens()
+        db.session.commit()
+        if not User.query.filter_by(email='admin@example.com').first():
+            admin = User(email='admin@example.com', name='Адміністратор системи', role='admin', is_active=True)
+            admin.set_password('admin123')
+            db.session.add(admin)
+            db.session.commit()
+
 if __name__ == '__main__':
     app = create_app()
+    init_app_data(app)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from docx import Document as DocxDocument
+from models import db, User, Document, Author, AuthorToken, Knowledge, Collection, CollectionItem, RecentlyViewed, document_author, author_sort_key
+from index_maintenance import index_writer
+from utils import extract_text
+
+# Детермінований генератор корпусу для бенчмарків.
+#
+# Однаковий seed і однаковий профіль дають той самий текст файлів і ті самі
+# рядки в БД, тож результати різних прогонів можна порівнювати між собою.
+# Рядки вставляємо пачками через Core insert, а не через ORM, інакше генерація
+# 500k нотаток займала б більше часу, ніж самі вимірювання.
+
+PROFILES = {
+    # Для CI і швидкої перевірки на ноутбуці
+    'small': dict(users=20, docs=300, files=60, authors=150, notes=10000, collections=5, items=20, views=5000),
+    # Цільовий масштаб з backlog-у: 10k документів і 500k нотаток
+    'full': dict(users=200, docs=10000, files=500, authors=3000, notes=500000, collections=10, items=200, views=200000),
+}
+
+DOC_TYPES = ['стаття', 'звіт', 'дисертація', 'книга', 'інше']
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ra', 'to', 'vi', 'zen', 'por', 'tal', 'ser', 'gon', 'dri', 'mun', 'fel', 'bas']
+SURNAMES = ['Ivanenko', 'Petrenko', 'Kovalenko', 'Bondarenko', 'Tkachenko', 'Kravchenko', 'Shevchenko',
+            'Boyko', 'Melnyk', 'Koval', 'Oliynyk', 'Lysenko', 'Marchenko', 'Rudenko', 'Savchenko', 'Smith',
+            'Johnson', 'Garcia', 'Muller', 'Rossi', 'Novak', 'Kowalski', 'Dubois', 'Tanaka', 'Wang']
+BATCH = 5000
+
+
+def vocabulary(rng, size=400):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def sentence(rng, words, n):
+    return ' '.join(rng.choice(words) for _ in range(n))
+
+
+def write_pdf(path, lines):
+    # Мінімальний PDF з одним шрифтом Helvetica — pypdf його читає без проблем
+    def escape(s): return s.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    stream = 'BT /F1 11 Tf 50 800 Td 14 TL ' + ' '.join(f"({escape(l)}) '" for l in lines) + ' ET'
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R '
+        '/Resources << /Font << /F1 5 0 R >> >> >>',
+        f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{i} 0 obj\n{obj}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{o:010d} 00000 n \n' for o in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def write_docx(path, lines):
+    doc = DocxDocument()
+    for line in lines:
+        doc.add_paragraph(line)
+    # python-docx пише поточний час у метадані, фіксуємо його
+    doc.core_properties.created = doc.core_properties.modified = datetime(2024, 1, 1)
+    doc.save(path)
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[i:i + BATCH])
+
+def generate_corpus(upload_folder, index_dir, profile='small', seed=42, **overrides):
+    # Повертає словник з розмірами згенерованого корпусу
+    p = dict(PROFILES[profile], **overrides)
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    os.makedirs(upload_folder, exist_ok=True)
+
+    # Файли: генеруємо `files` різних, а решту документів робимо жорсткими
+    # посиланнями на них, щоб 10k документів не займали гігабайти
+    sources = []
+    for i in range(p['files']):
+        lines = [sentence(rng, words, 12) for _ in range(rng.randint(20, 60))]
+        ext = '.pdf' if i % 2 == 0 else '.docx'
+        path = os.path.join(upload_folder, f'source_{i:05d}{ext}')
+        (write_pdf if ext == '.pdf' else write_docx)(path, lines)
+        sources.append(path)
+    texts = {path: extract_text(path) for path in sources}
+
+    # Користувачі: один хеш пароля на всіх, бо хешування — найдовша частина
+    probe = User(name='x', email='x')
+    probe.set_password('bench')
+    # create_app вже створив адміна, тож id користувачів починаємо після нього
+    first = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    users = [dict(id=i, email=f'user{i}@bench.example.com', name=f'Bench User {i}', password_hash=probe.password_hash,
+                  role='user', is_active=True, created_at=start) for i in range(first, first + p['users'])]
+    _insert(User.__table__, users)
+
+    keys = {}
+    while len(keys) < p['authors']:
+        name = f"{rng.choice(SURNAMES)} {rng.choice('ABCDEFGHIKLMNOPRSTV')}.{rng.choice('ABCDEFGHIKLMNOPRSTV')}."
+        keys.setdefault(author_sort_key(name), name)
+    authors = [dict(id=i, name=name, sort_key=key, document_count=0) for i, (key, name) in enumerate(sorted(keys.items()), 1)]
+    _insert(Author.__table__, authors)
+    # Фільтр за автором шукає по словах імені, тож токени потрібні так само, як у живій базі
+    _insert(AuthorToken.__table__, [dict(author_id=a['id'], token=t) for a in authors
+                                    for t in set(a['sort_key'].split())])
+
+    docs, links, fields = [], [], []
+    for doc_id in range(1, p['docs'] + 1):
+        source = sources[(doc_id - 1) % len(sources)]
+        ext = os.path.splitext(source)[1]
+        stored = f'bench_{doc_id:06d}{ext}'
+        target = os.path.join(upload_folder, stored)
+        if not os.path.exists(target): os.link(source, target)
+        chosen = rng.sample(authors, rng.randint(1, 3))
+        title = sentence(rng, words, rng.randint(3, 8)).capitalize()
+        year = rng.randint(1990, 2025)
+        docs.append(dict(id=doc_id, title=title, authors=', '.join(a['name'] for a in chosen), year=year,
+                         source=sentence(rng, words, 3), doc_type=rng.choice(DOC_TYPES),
+                         original_filename=f'paper_{doc_id}{ext}', stored_filename=stored,
+                         uploaded_at=start + timedelta(minutes=doc_id), uploaded_by=rng.randint(first, first + p['users'] - 1)))
+        links.extend(dict(document_id=doc_id, author_id=a['id']) for a in chosen)
+        fields.append(dict(id=str(doc_id), title=title, content=texts[source], authors=docs[-1]['authors'],
+                           year=str(year), path=target))
+    _insert(Document.__table__, docs)
+    _insert(document_author, links)
+    Author.refresh_counts([a['id'] for a in authors])
+
+    tags = [rng.choice(words) for _ in range(50)]
+    notes, by_user = [], {}
+    for k_id in range(1, p['notes'] + 1):
+        user_id = rng.randint(first, first + p['users'] - 1)
+        notes.append(dict(id=k_id, document_id=rng.randint(1, p['docs']), user_id=user_id,
+                          text=sentence(rng, words, rng.randint(8, 30)), note=sentence(rng, words, 6),
+                          tags=', '.join(rng.sample(tags, 2)), created_at=start + timedelta(seconds=k_id)))
+        by_user.setdefault(user_id, []).append(k_id)
+    _insert(Knowledge.__table__, notes)
+
+    collections, items, c_id = [], [], 0
+    for user_id in range(first, first + p['users']):
+        user_notes = by_user.get(user_id, [])
+        for n in range(p['collections']):
+            c_id += 1
+            collections.append(dict(id=c_id, name=f'Collection {n}', user_id=user_id, created_at=start))
+            for k_id in rng.sample(user_notes, min(p['items'], len(user_notes))):
+                items.append(dict(collection_id=c_id, knowledge_id=k_id, created_at=start))
+    _insert(Collection.__table__, collections)
+    _insert(CollectionItem.__table__, items)
+
+    views = [dict(user_id=rng.randint(first, first + p['users'] - 1), document_id=rng.randint(1, p['docs']),
+                  viewed_at=start + timedelta(seconds=i)) for i in range(p['views'])]
+    _insert(RecentlyViewed.__table__, views)
+    db.session.commit()
+
+    with index_writer(index_dir) as writer:
+        for f in fields:
+            writer.add_document(**f)
+
+    # Для сценаріїв: найактивніший користувач і його нотатки
+    user_id = max(by_user, key=lambda u: len(by_user[u]))
+    return dict(p, seed=seed, words=words, author_names=[a['name'] for a in authors], user_id=user_id,
+                user_email=f'user{user_id}@bench.example.com', user_notes=by_user[user_id],
+                collection_id=next(c['id'] for c in collections if c['user_id'] == user_id))
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from io import BytesIO
+from datetime import datetime
+from sqlalchemy import event
+
+from app import create_app, init_app_data
+from config import Config
+from models import db
+from utils import extract_text, search_fulltext
+from benchmarks.corpus import PROFILES, generate_corpus, write_docx, write_pdf
+
+# Прогін бенчмарків:
+#
+#   python -m benchmarks.run --profile small                  # виміряти і порівняти з baseline
+#   python -m benchmarks.run --profile full --save-baseline   # записати новий baseline
+#
+# Для кожного сценарію міряємо p50/p95 затримки, пропускну здатність, кількість
+# SQL-запитів на операцію і пікову пам'ять (окремим проходом під tracemalloc,
+# щоб він не спотворював час). Регресією вважаємо ріст p95 або кількості
+# запитів більше ніж у --threshold разів відносно baseline.
+#
+# Baseline для профілю small лежить у репозиторії (benchmarks/baseline.json).
+# Кількість запитів від машини не залежить, тож CI порівнює тільки її:
+#
+#   python -m benchmarks.run --profile small --metrics queries_mean
+#
+# Час порівнюємо локально, знявши baseline на тій самій машині. Якщо зміна
+# свідомо міняє кількість запитів, baseline оновлюють тим самим комітом
+# (--save-baseline на профілі small).
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_OUTPUT = 'bench_results.json'
+COMPARED_METRICS = ('p95_ms', 'queries_mean')
+
+
+def make_config(workdir):
+    class BenchConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(workdir, 'uploads')
+        WHOOSH_BASE = os.path.join(workdir, 'index')
+        INDEX_WRITER = 'inline'
+    return BenchConfig
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+def measure(fn, iterations, counter):
+    fn(0)  # прогрів: кеші шаблонів, з'єднання з БД
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for i in range(iterations):
+        before = counter.count
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+        queries.append(counter.count - before)
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn(iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'throughput_ops': round(iterations / total, 2),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def scenarios(client, corpus, workdir):
+    words, authors, notes = corpus['words'], corpus['author_names'], corpus['user_notes']
+    docs, col = corpus['docs'], corpus['collection_id']
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+
+    def post(url, data, **kw):
+        response = client.post(url, data=data, **kw)
+        assert response.status_code in (200, 302), (url, response.status_code)
+
+    def upload(i):
+        post('/document/upload', {'title': f'Bench upload {i}', 'authors': authors[i % len(authors)], 'year': 2024,
+                                  'source': '', 'doc_type': 'стаття', 'file': (BytesIO(sample_docx), f'up{i}.docx')},
+             content_type='multipart/form-data')
+
+    sample_pdf = os.path.join(workdir, 'sample.pdf')
+    write_pdf(sample_pdf, [' '.join(words[j:j + 12]) for j in range(0, 360, 12)])
+    sample_docx_path = os.path.join(workdir, 'sample.docx')
+    write_docx(sample_docx_path, [' '.join(words[j:j + 12]) for j in range(0, 360, 12)])
+    with open(sample_docx_path, 'rb') as f:
+        sample_docx = f.read()
+    index_dir = client.application.config['WHOOSH_BASE']
+
+    return {
+        'route:index': lambda i: get('/'),
+        'route:documents': lambda i: get('/documents'),
+        'route:documents_search': lambda i: get(f'/documents?q={words[i % len(words)]}'),
+        'route:documents_search_repeat': lambda i: get(f'/documents?q={words[0]}'),
+        'route:documents_author': lambda i: get(f'/documents?author={authors[i % len(authors)].split()[0]}'),
+        'route:document_detail': lambda i: get(f'/document/{i % docs + 1}'),
+        'route:my_knowledge': lambda i: get('/my/knowledge'),
+        'route:my_knowledge_collections': lambda i: get('/my/knowledge?tab=collections&col_sort=count_desc'),
+        'route:export_docx': lambda i: post('/my/knowledge', {'action': 'export_docx', 'knowledge_ids': notes[:50]}),
+        'route:collection_export': lambda i: get(f'/collection/{col}/export/docx'),
+        'route:add_to_collection': lambda i: post('/my/knowledge', {'action': 'add_to_collection', 'collection_id': col,
+                                                                    'knowledge_ids': notes[:100]}),
+        'route:upload': upload,
+        'utils:extract_text_pdf': lambda i: extract_text(sample_pdf),
+        'utils:extract_text_docx': lambda i: extract_text(sample_docx_path),
+        'utils:search_fulltext': lambda i: search_fulltext(words[i % len(words)], index_dir),
+    }
+
+
+def run_benchmarks(profile='small', seed=42, iterations=20, only=None, workdir=None, **overrides):
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='cw-bench-')
+    try:
+        app = create_app(make_config(workdir))
+        init_app_data(app)
+        with app.app_context():
+            started = time.perf_counter()
+            corpus = generate_corpus(app.config['UPLOAD_FOLDER'], app.config['WHOOSH_BASE'], profile, seed, **overrides)
+            generated_in = time.perf_counter() - started
+            counter = QueryCounter(db.engine)
+            db.session.remove()
+
+        # Запити виконуємо поза app_context, щоб кожен мав свою сесію, як у продакшні
+        client = app.test_client()
+        response = client.post('/login', data={'email': corpus['user_email'], 'password': 'bench'})
+        assert response.status_code == 302, 'Не вдалося увійти користувачем корпусу'
+        results = {}
+        for name, fn in scenarios(client, corpus, workdir).items():
+            if only and not any(name.startswith(o) for o in only): continue
+            results[name] = measure(fn, iterations, counter)
+            print(f"{name:36s} p50 {results[name]['p50_ms']:9.2f} ms  p95 {results[name]['p95_ms']:9.2f} ms  "
+                  f"{results[name]['queries_mean']:7.1f} q/op  {results[name]['peak_memory_kb']:9.1f} KB")
+
+        sizes = {k: corpus[k] for k in PROFILES[profile]}
+        return {
+            'meta': {'profile': profile, 'seed': seed, 'iterations': iterations, 'corpus': sizes,
+                     'corpus_seconds': round(generated_in, 2), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'created_at': datetime.now().isoformat(timespec='seconds')},
+            'scenarios': results,
+        }
+    finally:
+        if own_workdir: shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold=1.25, metrics=COMPARED_METRICS):
+    # Повертає список регресій (сценарій, метрика, baseline, зараз)
+    regressions = []
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base: continue
+        for metric in metrics:
+            if current[metric] > max(base[metric], 0.001) * threshold:
+                regressions.append((name, metric, base[metric], current[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки маршрутів і утиліт на синтетичному корпусі')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', nargs='*', help='Префікси назв сценаріїв, напр. route:documents')
+    parser.add_argument('--docs', type=int, help='Перевизначити кількість документів у профілі')
+    parser.add_argument('--notes', type=int, help='Перевизначити кількість нотаток у профілі')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--metrics', nargs='*', choices=COMPARED_METRICS, default=COMPARED_METRICS,
+                        help='Які метрики порівнювати з baseline')
+    args = parser.parse_args(argv)
+
+    overrides = {k: v for k, v in (('docs', args.docs), ('notes', args.notes)) if v}
+    results = run_benchmarks(args.profile, args.seed, args.iterations, args.only, **overrides)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f'Результати: {args.output}')
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f'Baseline оновлено: {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('Baseline ще не записано, порівнювати нема з чим (--save-baseline)')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['meta']['profile'] != args.profile or baseline['meta']['corpus'] != results['meta']['corpus']:
+        print('Увага: baseline знято на іншому корпусі, порівняння орієнтовне')
+    regressions = compare(results, baseline, args.threshold, args.metrics)
+    for name, metric, before, now in regressions:
+        print(f'РЕГРЕСІЯ {name}: {metric} {before} -> {now}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
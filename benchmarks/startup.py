@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Звіт про холодний старт: кожен замір — окремий свіжий інтерпретатор, щоб
+# кеш імпортів попереднього запуску не впливав на результат.
+#
+#   python -m benchmarks.startup --runs 10
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('docx', 'pypdf', 'whoosh')
+
+PROBE = '''
+import sys, time, json, tempfile, os
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+from config import Config
+workdir = tempfile.mkdtemp()
+class ProbeConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'probe.db')
+    UPLOAD_FOLDER = os.path.join(workdir, 'uploads')
+    WHOOSH_BASE = os.path.join(workdir, 'index')
+application = app.create_app(ProbeConfig)
+t2 = time.perf_counter()
+heavy = sorted({m.split('.')[0] for m in sys.modules} & set(%r))
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'create_app_ms': (t2 - t1) * 1000, 'heavy': heavy}))
+''' % (HEAVY_MODULES,)
+
+
+def measure(runs=5):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        'runs': runs,
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 1),
+        'create_app_ms': round(statistics.median(s['create_app_ms'] for s in samples), 1),
+        'cold_start_ms': round(statistics.median(s['import_ms'] + s['create_app_ms'] for s in samples), 1),
+        'heavy_modules_loaded': samples[-1]['heavy'],
+    }
+
+def top_imports(limit=15):
+    # Найдорожчі модулі за `python -X importtime` (кумулятивний час, мкс)
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        parts = line[len('import time:'):].split('|')
+        name = parts[2].rstrip()
+        rows.append((int(parts[1]), name.strip(), (len(name) - len(name.lstrip()) - 1) // 2))
+    # Сам app і те, що він імпортує напряму (кожен рівень вкладеності — 2 пробіли)
+    top = [(us, name) for us, name, depth in rows if depth <= 1]
+    return [{'module': name, 'cumulative_ms': round(us / 1000, 1)} for us, name in sorted(top, reverse=True)[:limit]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Час імпорту і холодного старту create_app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    report = measure(args.runs)
+    report['top_imports'] = top_imports()
+    print(f"import app:    {report['import_ms']} ms")
+    print(f"create_app:    {report['create_app_ms']} ms")
+    print(f"cold start:    {report['cold_start_ms']} ms (медіана з {report['runs']})")
+    print(f"важкі модулі:  {', '.join(report['heavy_modules_loaded']) or 'не завантажені'}")
+    for row in report['top_imports']:
+        print(f"  {row['cumulative_ms']:8.1f} ms  {row['module']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
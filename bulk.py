@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+from sqlalchemy.dialects.sqlite import insert
+from models import db, Knowledge, Collection, CollectionItem
+
+# Масові дії над нотатками і колекціями.
+#
+# Кожна дія — один-два SQL-запити на всю вибірку, а не запит на кожну нотатку:
+# INSERT ... SELECT з ON CONFLICT DO NOTHING (дублікати відсікає унікальний
+# індекс uq_collection_item) і масові DELETE/UPDATE. Права перевіряє сам SQL:
+# чужі нотатки й колекції просто не потрапляють у вибірку. Функції не комітять —
+# маршрут робить один коміт, тож дія або застосовується цілком, або ніяк.
+# Повертають кількість рядків, яких реально торкнулися.
+
+
+def _own_notes(user_id, knowledge_ids):
+    return db.select(Knowledge.id).where(Knowledge.user_id == user_id, Knowledge.id.in_(knowledge_ids))
+
+def _own_collection(user_id, collection_id):
+    return db.select(Collection.id).where(Collection.id == collection_id, Collection.user_id == user_id)
+
+def ensure_unique_items():
+    # Для баз, створених до появи унікального індексу: прибираємо повтори і створюємо його
+    db.session.execute(db.text('DELETE FROM collection_item WHERE id NOT IN '
+                               '(SELECT MIN(id) FROM collection_item GROUP BY collection_id, knowledge_id)'))
+    db.session.execute(db.text('CREATE UNIQUE INDEX IF NOT EXISTS uq_collection_item '
+                               'ON collection_item (collection_id, knowledge_id)'))
+    db.session.commit()
+
+def add_to_collection(user_id, collection_id, knowledge_ids):
+    if not knowledge_ids: return 0
+    now = datetime.now(timezone.utc)
+    rows = _own_notes(user_id, knowledge_ids)\
+        .add_columns(db.literal(collection_id).label('collection_id'), db.literal(now).label('created_at'))\
+        .where(db.exists(_own_collection(user_id, collection_id)))
+    stmt = insert(CollectionItem).from_select(['knowledge_id', 'collection_id', 'created_at'], rows)\
+        .on_conflict_do_nothing(index_elements=['collection_id', 'knowledge_id'])
+    return db.session.execute(stmt).rowcount
+
+def remove_from_collection(user_id, collection_id, knowledge_ids):
+    if not knowledge_ids: return 0
+    stmt = db.delete(CollectionItem).where(CollectionItem.collection_id.in_(_own_collection(user_id, collection_id)),
+                                           CollectionItem.knowledge_id.in_(knowledge_ids))\
+        .execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount
+
+def move_between_collections(user_id, from_id, to_id, knowledge_ids):
+    # Переносимо тільки те, що справді лежало в колекції-джерелі
+    if not knowledge_ids or from_id == to_id: return 0
+    if not db.session.execute(_own_collection(user_id, to_id)).first(): return 0
+    in_source = db.select(CollectionItem.knowledge_id).where(
+        CollectionItem.collection_id.in_(_own_collection(user_id, from_id)), CollectionItem.knowledge_id.in_(knowledge_ids))
+    moving = db.session.scalars(in_source).all()
+    if not moving: return 0
+    add_to_collection(user_id, to_id, moving)
+    return remove_from_collection(user_id, from_id, moving)
+
+def retag(user_id, knowledge_ids, tags):
+    if not knowledge_ids: return 0
+    tags = ', '.join(t.strip() for t in tags.split(',') if t.strip())
+    stmt = db.update(Knowledge).where(Knowledge.user_id == user_id, Knowledge.id.in_(knowledge_ids))\
+        .values(tags=tags).execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount
+
+def delete_notes(user_id, knowledge_ids):
+    if not knowledge_ids: return 0
+    own = _own_notes(user_id, knowledge_ids)
+    db.session.execute(db.delete(CollectionItem).where(CollectionItem.knowledge_id.in_(own))
+                       .execution_options(synchronize_session=False))
+    stmt = db.delete(Knowledge).where(Knowledge.user_id == user_id, Knowledge.id.in_(knowledge_ids))\
+        .execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount
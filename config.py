@@ -21,4 +21,37 @@ class Config:
     
     # Налаштування для пошукового двіжка, щоб не блокував файли
     WHOOSH_INDEXING_PARAMS = {"limitmb": 256, "procs": 1, "multisegment": True}
-    WHOOSH_DISABLE_LOCKING = True
\ No newline at end of file
+    WHOOSH_DISABLE_LOCKING = True
+    
+    # Через скільки секунд лок індексу без живого власника вважається покинутим
+    WHOOSH_LOCK_LEASE = 300
+    
+    # Хто застосовує чергу змін індексу: 'thread' — фоновий потік (один на всі
+    # процеси завдяки лізингу), 'external' — окремий `flask index worker`,
+    # 'inline' — одразу в запиті (для тестів і розробки)
+    INDEX_WRITER = 'thread'
+    # Груповий коміт: через скільки секунд або після скількох змін скидати чергу
+    INDEX_COMMIT_DELAY = 0.2
+    INDEX_COMMIT_BATCH = 100
+    # Скільки запит чекає, поки його зміна стане видимою в пошуку
+    INDEX_VISIBILITY_TIMEOUT = 2.0
+    
+    # Скільки різних пошукових запитів тримаємо в кеші результатів
+    SEARCH_CACHE_SIZE = 1000
+    
+    # Скільки секунд живуть записи кешу в пам'яті процесу (юзери, списки, HTML-фрагменти);
+    # 0 вимикає кеш
+    LOCAL_CACHE_TTL = 30
+    
+    # З якої оцінки схожості (Жаккар за MinHash) документи вважаються майже-дублікатами
+    DUPLICATE_THRESHOLD = 0.8
+    
+    # Структуровані логи запитів: повільніші за SLOW_REQUEST_MS пишемо як WARNING
+    REQUEST_LOG_LEVEL = os.environ.get('REQUEST_LOG_LEVEL', 'WARNING')
+    SLOW_REQUEST_MS = 500
+    
+    # Семплінг-профайлер запитів (?_profile=1 від адміна або випадкова частка запитів)
+    PROFILER_ENABLED = False
+    PROFILER_SAMPLE_RATE = 0.0
+    PROFILER_INTERVAL = 0.005
+    PROFILE_DIR = os.path.join(basedir, 'instance', 'profiles')
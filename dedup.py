@@ -0,0 +1,127 @@
+import re
+import hashlib
+from array import array
+from models import db, DocumentSignature, LshBucket
+
+# Пошук майже-дублікатів (препринт і фінальна версія, той самий PDF з різних експортів).
+#
+# Підпис документа — MinHash по шинглах (трійках слів) тексту, який і так дає
+# extract_text. Замість 128 хеш-функцій на кожен шингл рахуємо один 64-бітний
+# хеш (one permutation hashing): молодші біти вибирають комірку, решта — значення,
+# у комірці лишається мінімум. Порожні комірки заповнюємо з найближчої непорожньої
+# (densification), і тоді, як у звичайному MinHash, частка збігів по позиціях
+# оцінює схожість Жаккара.
+#
+# LSH: підпис ріжемо на BANDS смуг по ROWS значень і хеш кожної смуги кладемо в
+# таблицю lsh_bucket. Кандидати — документи, що збіглися хоча б в одній смузі, тож
+# пошук іде по індексу, а не перебором колекції. Кандидатів перевіряємо оцінкою
+# схожості за повними підписами. При 16×8 пара зі схожістю 0.8 стає кандидатом
+# з імовірністю ~95%, а зі схожістю 0.5 — ~6%.
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+THRESHOLD = 0.8
+
+_BIN_BITS = NUM_PERM.bit_length() - 1
+_EMPTY = 1 << 64
+_WORD_RE = re.compile(r'\w+')
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def shingles(text):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE: return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash(text):
+    # Підпис з NUM_PERM чисел або None, якщо тексту нема (скан без OCR, помилка екстракції)
+    sig = [_EMPTY] * NUM_PERM
+    for shingle in shingles(text):
+        h = _hash64(shingle.encode('utf-8'))
+        b, v = h & (NUM_PERM - 1), h >> _BIN_BITS
+        if v < sig[b]: sig[b] = v
+    if all(v == _EMPTY for v in sig): return None
+    # Порожня комірка бере значення наступної непорожньої (по колу) зі зсувом на відстань,
+    # щоб позичені значення різних комірок не збігалися між собою випадково
+    original = list(sig)
+    for i in range(NUM_PERM):
+        if original[i] != _EMPTY: continue
+        step = 1
+        while original[(i + step) % NUM_PERM] == _EMPTY: step += 1
+        sig[i] = original[(i + step) % NUM_PERM] + (step << (64 - _BIN_BITS))
+    return sig
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def band_keys(sig):
+    return [(band, hashlib.blake2b(array('Q', sig[band * ROWS:(band + 1) * ROWS]).tobytes(),
+                                   digest_size=8).hexdigest())
+            for band in range(BANDS)]
+
+def pack(sig):
+    return array('Q', sig).tobytes()
+
+def unpack(blob):
+    sig = array('Q')
+    sig.frombytes(blob)
+    return list(sig)
+
+
+def find_similar(sig, exclude=None, threshold=THRESHOLD):
+    # [(document_id, схожість)] за спаданням схожості
+    keys = band_keys(sig)
+    candidates = db.session.query(LshBucket.document_id)\
+        .filter(db.or_(*[db.and_(LshBucket.band == band, LshBucket.bucket == bucket) for band, bucket in keys]))
+    if exclude is not None: candidates = candidates.filter(LshBucket.document_id != exclude)
+    rows = DocumentSignature.query.filter(DocumentSignature.document_id.in_(candidates.distinct())).all()
+    found = [(row.document_id, similarity(sig, unpack(row.minhash))) for row in rows]
+    return sorted([f for f in found if f[1] >= threshold], key=lambda f: -f[1])
+
+def register_document(doc_id, text, threshold=THRESHOLD):
+    # Зберігає підпис і смуги документа, об'єднує його кластер з уже відомими
+    # дублікатами і повертає їх. Коміт — на боці виклику
+    forget_document(doc_id)
+    sig = minhash(text)
+    if sig is None: return []
+    matches = find_similar(sig, exclude=doc_id, threshold=threshold)
+    clusters = {row.cluster_id for row in DocumentSignature.query.filter(
+        DocumentSignature.document_id.in_([m[0] for m in matches]))} if matches else set()
+    # Кластер називаємо за найстаршим документом групи
+    cluster_id = min(clusters | {doc_id})
+    if clusters:
+        DocumentSignature.query.filter(DocumentSignature.cluster_id.in_(clusters))\
+            .update({DocumentSignature.cluster_id: cluster_id}, synchronize_session=False)
+    db.session.add(DocumentSignature(document_id=doc_id, minhash=pack(sig), cluster_id=cluster_id))
+    db.session.add_all([LshBucket(band=band, bucket=bucket, document_id=doc_id) for band, bucket in band_keys(sig)])
+    db.session.flush()
+    return matches
+
+def forget_document(doc_id):
+    LshBucket.query.filter_by(document_id=doc_id).delete(synchronize_session=False)
+    DocumentSignature.query.filter_by(document_id=doc_id).delete(synchronize_session=False)
+
+def similar_documents(doc_id, threshold=THRESHOLD):
+    row = db.session.get(DocumentSignature, doc_id)
+    if row is None: return []
+    return find_similar(unpack(row.minhash), exclude=doc_id, threshold=threshold)
+
+def collapse_duplicates(documents):
+    # Лишає з кожного кластера перший документ списку. Повертає (документи,
+    # {id: скільки версій сховано}, {id: кластер}) — останнє для посилання на всі версії
+    if not documents: return documents, {}, {}
+    clusters = dict(db.session.query(DocumentSignature.document_id, DocumentSignature.cluster_id)
+                    .filter(DocumentSignature.document_id.in_([d.id for d in documents])))
+    kept, hidden, first = [], {}, {}
+    for doc in documents:
+        cluster = clusters.get(doc.id)
+        if cluster is not None and cluster in first:
+            hidden[first[cluster]] = hidden.get(first[cluster], 0) + 1
+            continue
+        if cluster is not None: first[cluster] = doc.id
+        kept.append(doc)
+    return kept, hidden, clusters
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import socket
+from contextlib import contextmanager
+from models import db, Document
+from metrics import registry
+
+# Скільки секунд вважаємо власника запису живим, поки він не оновив лізинг
+LEASE_SECONDS = 300
+# Скільки секунд чекаємо на чужий лок перед LockError
+WRITER_TIMEOUT = 10.0
+# Після скількох сегментів індекс зливаємо в один
+MAX_SEGMENTS = 8
+
+LOCK_NAME = 'MAIN_WRITELOCK'
+LEASE_FILE = 'MAIN_WRITELOCK.lease'
+MAINTENANCE_LEASE_FILE = 'MAINTENANCE.lease'
+
+
+# === Лізинги ===
+# Поруч з локом Whoosh пишемо файл з pid, хостом і часом, щоб інші воркери
+# могли відрізнити живий запис від покинутого, а не знімати лок навмання.
+def _lease_path(index_dir, name=LEASE_FILE):
+    return os.path.join(index_dir, name)
+
+def read_lease(index_dir, name=LEASE_FILE):
+    try:
+        with open(_lease_path(index_dir, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_lease(index_dir, name=LEASE_FILE):
+    lease = {'pid': os.getpid(), 'host': socket.gethostname(), 'acquired_at': time.time()}
+    tmp = _lease_path(index_dir, name) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(lease, f)
+    os.replace(tmp, _lease_path(index_dir, name))
+    return lease
+
+def drop_lease(index_dir, name=LEASE_FILE):
+    try: os.remove(_lease_path(index_dir, name))
+    except OSError: pass
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+def lease_expired(lease, lease_seconds=LEASE_SECONDS):
+    if not lease: return True
+    # На тому ж хості вирішує тільки те, чи живий процес-власник: довге злиття
+    # може тримати лок скільки завгодно, і знімати його з-під живого писаря не можна
+    if lease.get('host') == socket.gethostname():
+        return not _pid_alive(lease.get('pid', -1))
+    # Процес на іншому хості перевірити не можемо — лишається вік лізингу
+    return time.time() - lease.get('acquired_at', 0) > lease_seconds
+
+def recover_stale_lock(index_dir, lease_seconds=LEASE_SECONDS):
+    # Повертає True, якщо знайшли і прибрали покинутий лок
+    from whoosh.index import exists_in
+    from whoosh.filedb.filestore import FileStorage
+    if not exists_in(index_dir): return False
+    lease = read_lease(index_dir)
+    if lease and not lease_expired(lease, lease_seconds):
+        return False
+
+    had_lock_file = os.path.exists(os.path.join(index_dir, LOCK_NAME))
+    lock = FileStorage(index_dir).lock(LOCK_NAME)
+    if lock.acquire(blocking=False):
+        # Лок вільний — просто прибираємо сміття після впалого процесу
+        lock.release()
+        drop_lease(index_dir)
+        return lease is not None or had_lock_file
+    if lease and lease.get('host') == socket.gethostname():
+        # flock знімає ядро, коли процес помирає, тож зайнятий лок на цьому хості
+        # тримає живий процес (напр. writer, що ще не встиг записати свій лізинг).
+        # Прибираємо тільки лізинг мертвого процесу, а файл локу не чіпаємо
+        drop_lease(index_dir)
+        return False
+    if lease:
+        # Лок іншого хоста з протухлим лізингом: власник завис або помер на
+        # файловій системі без нормальних локів — тільки тоді знімаємо примусово.
+        # Новий файл локу означає новий inode, тож наступні writer-и його візьмуть
+        try: os.remove(os.path.join(index_dir, LOCK_NAME))
+        except OSError: pass
+        drop_lease(index_dir)
+        return True
+    return False
+
+
+@contextmanager
+def index_writer(index_dir, mergetype=None, timeout=WRITER_TIMEOUT):
+    # Єдина точка, через яку беремо writer: чекаємо на лок з таймаутом,
+    # ставимо лізинг і завжди його знімаємо, навіть якщо запис упав
+    from whoosh.index import open_dir
+    ix = open_dir(index_dir)
+    writer = ix.writer(timeout=timeout)
+    write_lease(index_dir)
+    try:
+        yield writer
+        with registry.timer('index_commit_seconds'):
+            writer.commit(mergetype=mergetype or merge_policy())
+    except Exception:
+        writer.cancel()
+        raise
+    finally:
+        drop_lease(index_dir)
+
+
+# === Злиття сегментів ===
+def merge_policy(max_segments=MAX_SEGMENTS):
+    # Звичайний коміт зливає тільки дрібні сегменти, а коли їх стало
+    # забагато — переписуємо індекс в один сегмент
+    def policy(writer, segments):
+        from whoosh.writing import MERGE_SMALL, OPTIMIZE
+        if len(segments) > max_segments:
+            return OPTIMIZE(writer, segments)
+        return MERGE_SMALL(writer, segments)
+    return policy
+
+def segment_count(index_dir):
+    from whoosh.index import open_dir, exists_in
+    if not exists_in(index_dir): return 0
+    return len(open_dir(index_dir)._segments())
+
+def merge_segments(index_dir, optimize=True, lease_seconds=LEASE_SECONDS):
+    # Повертає (сегментів до, сегментів після) або None, якщо злиття вже
+    # виконує інший воркер
+    from whoosh.index import exists_in
+    from whoosh.writing import MERGE_SMALL, OPTIMIZE
+    if not exists_in(index_dir): return None
+    lease = read_lease(index_dir, MAINTENANCE_LEASE_FILE)
+    if lease and not lease_expired(lease, lease_seconds): return None
+    write_lease(index_dir, MAINTENANCE_LEASE_FILE)
+    try:
+        before = segment_count(index_dir)
+        with index_writer(index_dir, mergetype=OPTIMIZE if optimize else MERGE_SMALL):
+            pass
+        return before, segment_count(index_dir)
+    finally:
+        drop_lease(index_dir, MAINTENANCE_LEASE_FILE)
+
+
+# === Оновлення схеми ===
+def upgrade_schema(index_dir):
+    # Індекс зі старою схемою (напр. ще без полів spell_*) переписуємо за поточною
+    # зі збережених полів, тексти з файлів заново не витягаємо. Повертає кількість
+    # переписаних документів або None, якщо схема вже актуальна
+    from whoosh.index import open_dir, exists_in
+    from whoosh.writing import CLEAR
+    from utils import get_schema
+    if not exists_in(index_dir): return None
+    schema = get_schema()
+    if set(open_dir(index_dir).schema.names()) == set(schema.names()): return None
+    count = 0
+    # CLEAR викидає старі сегменти тим самим комітом, що додає переписані
+    with index_writer(index_dir, mergetype=CLEAR) as writer:
+        with writer.reader() as reader:
+            writer.schema = schema
+            for fields in reader.all_stored_fields():
+                writer.add_document(**{k: v for k, v in fields.items() if k in schema})
+                count += 1
+    return count
+
+
+# === Звірка БД та індексу ===
+def indexed_ids(index_dir):
+    from whoosh.index import open_dir, exists_in
+    if not exists_in(index_dir): return set()
+    ix = open_dir(index_dir)
+    with ix.searcher() as searcher:
+        # У лексиконі лишаються терми видалених документів до злиття,
+        # тому перевіряємо, що за термом є живий документ
+        return {t.decode() for t in searcher.lexicon('id')
+                if searcher.document_number(id=t.decode()) is not None}
+
+def reconcile_index(index_dir, upload_folder, repair=False):
+    db_ids = {str(i) for (i,) in db.session.query(Document.id)}
+    idx_ids = indexed_ids(index_dir)
+    missing = sorted(db_ids - idx_ids, key=int)
+    orphans = sorted(idx_ids - db_ids, key=int)
+
+    if repair and (missing or orphans):
+        # Через чергу, як і решта змін індексу: текст писар витягне до того, як брати лок
+        from index_queue import IndexQueue
+        queue = IndexQueue(index_dir)
+        for doc_id in orphans:
+            queue.delete(int(doc_id))
+        for doc in Document.query.filter(Document.id.in_([int(i) for i in missing])):
+            queue.add(doc, os.path.join(upload_folder, doc.stored_filename))
+        queue.drain_all()
+    return {'missing': [int(i) for i in missing], 'orphans': [int(i) for i in orphans], 'repaired': repair}
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from index_maintenance import index_writer, read_lease, write_lease, drop_lease, lease_expired
+from utils import document_fields, extract_text, init_search_index
+from sqlite_file import SqliteFile
+
+index_log = logging.getLogger('cw.index')
+
+# Черга змін індексу.
+#
+# Воркери не беруть writer Whoosh самі, а тільки дописують завдання в SQLite-чергу
+# поруч з індексом (це дешево і не конфліктує на локу). Застосовує їх один
+# писар — потік з лізингом або окремий процес `flask index worker`. Писар збирає
+# завдання пачкою (груповий коміт): коли найстаріше чекає MAX_DELAY секунд або
+# назбиралося MAX_BATCH штук, і комітить їх одним writer-ом.
+#
+# Гарантія видимості (read-your-writes): enqueue повертає порядковий номер
+# завдання. Після wait_for(seq) == True будь-який новий searcher у будь-якому
+# воркері вже бачить цю зміну. Якщо wait_for повернув False (таймаут), зміна
+# лишається в черзі на диску і з'явиться в індексі після наступного скидання —
+# вона не губиться навіть при падінні процесу.
+
+QUEUE_FILE = 'QUEUE.sqlite'
+WRITER_LEASE_FILE = 'QUEUE_WRITER.lease'
+WRITER_LEASE_SECONDS = 30
+MAX_DELAY = 0.2
+MAX_BATCH = 100
+
+QUEUE_DDL = (
+    'CREATE TABLE IF NOT EXISTS jobs (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'doc_id INTEGER NOT NULL, op TEXT NOT NULL, payload TEXT, enqueued_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+)
+
+
+class IndexQueue:
+    def __init__(self, index_dir, max_delay=MAX_DELAY, max_batch=MAX_BATCH):
+        self.index_dir = index_dir
+        self.path = os.path.join(index_dir, QUEUE_FILE)
+        self._file = SqliteFile(self.path, QUEUE_DDL)
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lease_refreshed = 0
+
+    def _db(self):
+        return self._file.connect()
+
+    # === Постановка в чергу (будь-який воркер) ===
+    def enqueue(self, op, doc_id, payload=None):
+        with self._db() as conn:
+            cur = conn.execute('INSERT INTO jobs (doc_id, op, payload, enqueued_at) VALUES (?, ?, ?, ?)',
+                               (doc_id, op, json.dumps(payload) if payload else None, time.time()))
+            seq = cur.lastrowid
+        self._wakeup.set()
+        return seq
+
+    def add(self, doc, filepath, content=None):
+        # Текст витягує писар, щоб запит не чекав на парсинг PDF. Якщо запит уже
+        # витяг його сам (для пошуку дублікатів), передаємо готовий
+        fields = document_fields(doc, filepath, with_content=False)
+        if content is not None: fields['content'] = content
+        return self.enqueue('add', doc.id, fields)
+
+    def delete(self, doc_id):
+        return self.enqueue('delete', doc_id)
+
+    def applied_seq(self):
+        with self._db() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'applied_seq'").fetchone()
+        return row[0] if row else 0
+
+    def pending(self):
+        # (кількість завдань, час найстарішого)
+        with self._db() as conn:
+            return conn.execute('SELECT COUNT(*), MIN(enqueued_at) FROM jobs').fetchone()
+
+    def wait_for(self, seq, timeout):
+        deadline = time.time() + timeout
+        while self.applied_seq() < seq:
+            if time.time() >= deadline: return False
+            time.sleep(0.01)
+        return True
+
+    # === Писар ===
+    def drain(self):
+        # Застосовує одну пачку завдань одним комітом, повертає кількість завдань
+        with self._db() as conn:
+            jobs = conn.execute('SELECT seq, doc_id, op, payload FROM jobs ORDER BY seq LIMIT ?',
+                                (self.max_batch,)).fetchall()
+        if not jobs: return 0
+
+        # Для кожного документа важлива тільки остання операція в пачці
+        latest = {}
+        for seq, doc_id, op, payload in jobs:
+            latest[doc_id] = (seq, op, json.loads(payload) if payload else None)
+        # Текст витягуємо до того, як брати лок, щоб не тримати індекс під час парсингу
+        for seq, op, fields in latest.values():
+            if op == 'add' and 'content' not in fields: fields['content'] = extract_text(fields['path'])
+
+        last_seq = jobs[-1][0]
+        from whoosh.index import exists_in
+        if not exists_in(self.index_dir): init_search_index(self.index_dir)
+        with index_writer(self.index_dir) as writer:
+            # Під локом перевіряємо, чи інший писар не встиг застосувати новіші зміни
+            applied = self.applied_seq()
+            for doc_id, (seq, op, fields) in latest.items():
+                if seq <= applied: continue
+                if op == 'add': writer.update_document(**fields)
+                else: writer.delete_by_term('id', str(doc_id))
+        with self._db() as conn:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('applied_seq', ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)", (last_seq,))
+            conn.execute('DELETE FROM jobs WHERE seq <= ?', (last_seq,))
+        return len(jobs)
+
+    def drain_all(self):
+        total = 0
+        while True:
+            n = self.drain()
+            if not n: return total
+            total += n
+
+    def _due(self):
+        count, oldest = self.pending()
+        if not count: return False
+        return count >= self.max_batch or time.time() - oldest >= self.max_delay
+
+    def _is_writer(self):
+        # Писар один на всі процеси: хто тримає свіжий лізинг, той і пише
+        now = time.time()
+        lease = read_lease(self.index_dir, WRITER_LEASE_FILE)
+        mine = bool(lease) and lease.get('pid') == os.getpid() and lease.get('host') == socket.gethostname()
+        if not mine and not lease_expired(lease, WRITER_LEASE_SECONDS):
+            return False
+        if not mine or now - self._lease_refreshed > WRITER_LEASE_SECONDS / 3:
+            write_lease(self.index_dir, WRITER_LEASE_FILE)
+            self._lease_refreshed = now
+        return True
+
+    def run(self, stop=None):
+        stop = stop or self._stop
+        while not stop.is_set():
+            try:
+                if self._is_writer() and self._due():
+                    self.drain()
+            except Exception:
+                # Завдання лишаються в черзі, наступний прохід спробує ще раз
+                index_log.exception('Index writer error')
+            self._wakeup.wait(self.max_delay / 2)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='index-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread: self._thread.join()
+        lease = read_lease(self.index_dir, WRITER_LEASE_FILE)
+        if lease and lease.get('pid') == os.getpid():
+            drop_lease(self.index_dir, WRITER_LEASE_FILE)
@@ -0,0 +1,90 @@
+import time
+import threading
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+from metrics import registry
+
+# Кеш у пам'яті процесу для того, що читається на кожному запиті, а міняється
+# рідко: користувач для flask-login, "нещодавно переглянуті", нові надходження,
+# списки для фільтрів і готові шматки HTML (тег {% cache %} у шаблонах).
+#
+# Ключі — кортежі, перший елемент — простір імен: ('user', 5), ('recent_views', 5).
+# invalidate('recent_views') скидає весь простір, invalidate('recent_views', 5) —
+# тільки записи цього юзера, разом з HTML-фрагментами під тим самим префіксом.
+# Скидаємо явно там, де дані міняються; TTL обмежує застарілість для інших
+# воркерів gunicorn, до яких це скидання не доходить.
+
+DEFAULT_TTL = 30
+MAX_ENTRIES = 4096
+
+_MISSING = object()
+
+
+class LocalCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Росте з кожним скиданням: значення, порахованому до скидання, не даємо потрапити в кеш
+        self._epoch = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl=None, epoch=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if ttl <= 0 or (epoch is not None and epoch != self._epoch): return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, compute, ttl=None):
+        # None не кешуємо: так відсутній юзер не "застрягає" до кінця TTL
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            registry.inc('local_cache_hits_total', namespace=key[0])
+            return value
+        registry.inc('local_cache_misses_total', namespace=key[0])
+        epoch = self._epoch
+        value = compute()
+        if value is not None: self.set(key, value, ttl, epoch)
+        return value
+
+    def invalidate(self, *prefix):
+        with self._lock:
+            self._epoch += 1
+            for key in [k for k in self._data if k[:len(prefix)] == prefix]:
+                del self._data[key]
+
+    def clear(self):
+        self.invalidate()
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache 'recent_views', current_user.id %}...{% endcache %} — HTML блоку
+    # лежить у LocalCache під ключем ('recent_views', <id>, 'html')
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        from flask import current_app
+        cache = current_app.extensions['local_cache']
+        return cache.get_or_set(tuple(parts) + ('html',), caller)
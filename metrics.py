@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# Метрики та профілювання.
+#
+# Лічильники й гістограми живуть у пам'яті процесу і віддаються на /metrics у
+# текстовому форматі Prometheus. Кожен воркер gunicorn має свій реєстр, тож
+# скрейпити варто кожен воркер окремо або сумувати на боці Prometheus.
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+request_log = logging.getLogger('cw.request')
+
+
+def _label_str(labels):
+    if not labels: return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + body + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            i = bisect_left(hist['buckets'], value)
+            if i < len(hist['counts']): hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        # Декоратор-обгортка над timer
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def value(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key in self._counters: return self._counters[key]
+            if key in self._gauges: return self._gauges[key]
+            hist = self._histograms.get(key)
+            return hist['count'] if hist else 0
+
+    def render(self):
+        # Текстовий формат експозиції Prometheus 0.0.4
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((k, dict(v, counts=list(v['counts']))) for k, v in self._histograms.items())
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name in typed: return
+            typed.add(name)
+            if name in self._help: lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_label_str(labels)} {value}')
+        for (name, labels), value in gauges:
+            header(name, 'gauge')
+            lines.append(f'{name}{_label_str(labels)} {value}')
+        for (name, labels), hist in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_str(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_label_str(labels + (("le", "+Inf"),))} {hist["count"]}')
+            lines.append(f'{name}_sum{_label_str(labels)} {hist["sum"]}')
+            lines.append(f'{name}_count{_label_str(labels)} {hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+registry = Metrics()
+registry.describe('http_requests_total', 'HTTP requests by endpoint, method and status')
+registry.describe('http_request_duration_seconds', 'Wall time of a request')
+registry.describe('http_request_sql_queries', 'SQL statements executed per request')
+registry.describe('sql_query_duration_seconds', 'Time of a single SQL statement')
+registry.describe('template_render_seconds', 'Jinja template rendering time')
+registry.describe('context_processor_seconds', 'Time spent in context processors')
+registry.describe('extract_text_seconds', 'Text extraction time by file type')
+registry.describe('extract_text_failures_total', 'Failed text extractions by file type')
+registry.describe('index_commit_seconds', 'Whoosh writer commit time')
+registry.describe('search_seconds', 'Full-text search time')
+registry.describe('search_cache_hits_total', 'Search result cache hits')
+registry.describe('search_cache_misses_total', 'Search result cache misses')
+registry.describe('local_cache_hits_total', 'In-process cache hits by namespace')
+registry.describe('local_cache_misses_total', 'In-process cache misses by namespace')
+
+
+class SamplingProfiler:
+    # Раз на interval секунд знімає стек потоку запиту. Результат — "згорнуті"
+    # стеки (формат flamegraph.pl / speedscope): "a;b;c <кількість знімків>"
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack: self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def init_metrics(app, engine):
+    # Підключає таймери запитів, SQL і шаблонів до застосунку
+    from flask import g, request, has_request_context, before_render_template, template_rendered
+    from flask_login import current_user
+    from sqlalchemy import event
+
+    if not request_log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        request_log.addHandler(handler)
+        request_log.setLevel(app.config['REQUEST_LOG_LEVEL'])
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _sql_started(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        registry.observe('sql_query_duration_seconds', elapsed)
+        if has_request_context() and hasattr(g, 'sql_queries'):
+            g.sql_queries += 1
+            g.sql_seconds += elapsed
+
+    @before_render_template.connect_via(app)
+    def _render_started(sender, template, context, **extra):
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def _render_finished(sender, template, context, **extra):
+        elapsed = time.perf_counter() - g.render_started.pop()
+        registry.observe('template_render_seconds', elapsed, template=template.name or '')
+        g.render_seconds = g.get('render_seconds', 0.0) + elapsed
+
+    @app.before_request
+    def _request_started():
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        rate = app.config['PROFILER_SAMPLE_RATE']
+        asked = request.args.get('_profile') == '1' and current_user.is_authenticated and current_user.role == 'admin'
+        wanted = app.config['PROFILER_ENABLED'] and (asked or (rate and random.random() < rate))
+        if wanted:
+            g.profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILER_INTERVAL']).start()
+
+    @app.after_request
+    def _request_finished(response):
+        if 'request_started' not in g: return response
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unknown'
+        registry.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        registry.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+        registry.observe('http_request_sql_queries', g.sql_queries, buckets=COUNT_BUCKETS, endpoint=endpoint)
+
+        if 'profiler' in g:
+            g.profiler.stop()
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            path = os.path.join(app.config['PROFILE_DIR'], f"{time.strftime('%Y%m%d_%H%M%S')}_{endpoint}_{os.getpid()}.folded")
+            g.profiler.dump(path)
+            response.headers['X-Profile-File'] = os.path.basename(path)
+
+        record = {'event': 'request', 'method': request.method, 'path': request.path, 'endpoint': endpoint,
+                  'status': response.status_code, 'duration_ms': round(elapsed * 1000, 2),
+                  'sql_queries': g.sql_queries, 'sql_ms': round(g.sql_seconds * 1000, 2),
+                  'render_ms': round(g.get('render_seconds', 0.0) * 1000, 2)}
+        level = logging.WARNING if elapsed * 1000 >= app.config['SLOW_REQUEST_MS'] else logging.INFO
+        request_log.log(level, json.dumps(record, ensure_ascii=False))
+        return response
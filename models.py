@@ -1,3 +1,5 @@
+import re
+import unicodedata
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime, timezone
@@ -7,6 +9,8 @@ db = SQLAlchemy()
 
 class CollectionItem(db.Model):
     __tablename__ = 'collection_item'
+    # Одна нотатка потрапляє в колекцію один раз; на цьому тримається масове додавання (bulk.py)
+    __table_args__ = (db.Index('uq_collection_item', 'collection_id', 'knowledge_id', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     collection_id = db.Column(db.Integer, db.ForeignKey('collection.id'))
     knowledge_id = db.Column(db.Integer, db.ForeignKey('knowledge.id'))
@@ -30,6 +34,82 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+# Зв'язок документів з авторами; індекс по author_id — для фільтра за автором
+document_author = db.Table('document_author',
+    db.Column('document_id', db.Integer, db.ForeignKey('document.id'), primary_key=True),
+    db.Column('author_id', db.Integer, db.ForeignKey('author.id'), primary_key=True, index=True)
+)
+
+# Частина, що складається лише з ініціалів: "J.", "J. K.", "O.-M."
+_INITIALS_RE = re.compile(r'^(?:\w\.[\s-]*)+$')
+
+def split_authors(text):
+    # "Іваненко І., Petrenko O.; Smith and Doe" -> окремі імена без повторів.
+    # ";" і сполучники завжди ділять авторів, а кома — тільки якщо після неї
+    # не самі ініціали: "Smith, J., Doe, A." -> "Smith J.", "Doe A."
+    names, seen = [], set()
+    for group in re.split(r';|\s+(?:and|та|і|&)\s+', text or ''):
+        parts = []
+        for part in group.split(','):
+            part = ' '.join(part.split())
+            if not part: continue
+            if parts and _INITIALS_RE.match(part): parts[-1] += ' ' + part
+            else: parts.append(part)
+        for name in parts:
+            if author_sort_key(name) not in seen:
+                names.append(name)
+                seen.add(author_sort_key(name))
+    return names
+
+def author_sort_key(name):
+    # Регістр, крапки в ініціалах і зайві пробіли не роблять автора іншим
+    name = unicodedata.normalize('NFKC', name).casefold().replace('.', ' ')
+    return ' '.join(name.split())
+
+class Author(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    sort_key = db.Column(db.String(200), nullable=False, unique=True, index=True)
+    # Рахуємо заздалегідь, щоб список авторів не робив COUNT на кожен рядок
+    document_count = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.relationship('AuthorToken', cascade='all, delete-orphan')
+
+    @staticmethod
+    def prefix_filter(text):
+        # Кожне слово запиту — префікс якогось слова імені: "petrenko" і "o petr"
+        # знаходять "Olena Petrenko". Діапазон замість LIKE, щоб працював індекс по token
+        conditions = [Author.id.in_(db.select(AuthorToken.author_id).where(AuthorToken.token.between(t, t + '\uffff')))
+                      for t in author_sort_key(text).split()]
+        return db.and_(db.true(), *conditions)
+
+    @staticmethod
+    def ensure_tokens():
+        # Для авторів, створених до появи таблиці author_token
+        for author in Author.query.filter(~Author.tokens.any()):
+            author.tokens = author_tokens(author.sort_key)
+
+    @staticmethod
+    def refresh_counts(author_ids):
+        # Перераховуємо лічильники і прибираємо авторів без документів
+        if not author_ids: return
+        db.session.flush()
+        counts = db.session.query(document_author.c.author_id, db.func.count())\
+            .filter(document_author.c.author_id.in_(author_ids))\
+            .group_by(document_author.c.author_id).all()
+        counts = dict(counts)
+        for author in Author.query.filter(Author.id.in_(author_ids)):
+            if counts.get(author.id): author.document_count = counts[author.id]
+            else: db.session.delete(author)
+
+class AuthorToken(db.Model):
+    __tablename__ = 'author_token'
+    # Окремі слова нормалізованого імені автора, по них шукає фільтр
+    author_id = db.Column(db.Integer, db.ForeignKey('author.id'), primary_key=True)
+    token = db.Column(db.String(200), primary_key=True, index=True)
+
+def author_tokens(sort_key):
+    return [AuthorToken(token=t) for t in sorted(set(sort_key.split()))]
+
 class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(300), nullable=False)
@@ -43,6 +123,38 @@ class Document(db.Model):
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     user = db.relationship('User', backref='documents')
+    author_list = db.relationship('Author', secondary=document_author, backref='documents')
+
+    def set_authors(self, text):
+        # Повертає id авторів, яких торкнулася зміна, щоб потім оновити лічильники
+        old_ids = {a.id for a in self.author_list}
+        names = split_authors(text)
+        keys = [author_sort_key(n) for n in names]
+        existing = {a.sort_key: a for a in Author.query.filter(Author.sort_key.in_(keys))} if keys else {}
+        authors = []
+        for name, key in zip(names, keys):
+            if key not in existing:
+                existing[key] = Author(name=name, sort_key=key, tokens=author_tokens(key))
+                db.session.add(existing[key])
+            authors.append(existing[key])
+        self.authors = text
+        self.author_list = authors
+        db.session.flush()
+        return old_ids | {a.id for a in authors}
+
+# MinHash-підпис тексту документа і його смуги для LSH (див. dedup.py)
+class DocumentSignature(db.Model):
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    minhash = db.Column(db.LargeBinary, nullable=False)
+    # Кластер майже-дублікатів — id найстаршого документа групи
+    cluster_id = db.Column(db.Integer, nullable=False, index=True)
+
+class LshBucket(db.Model):
+    __tablename__ = 'lsh_bucket'
+    # Первинний ключ (band, bucket, ...) і є індексом для пошуку кандидатів
+    band = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.String(16), primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True, index=True)
 
 class Knowledge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
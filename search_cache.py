@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from metrics import registry
+from sqlite_file import SqliteFile
+
+# Кеш результатів пошуку.
+#
+# Індекс змінюється тільки при завантаженні, редагуванні чи видаленні, і кожен
+# коміт Whoosh створює нову генерацію (_MAIN_<N>.toc). Кожен запис кешу
+# зберігає генерацію, на якій його порахували, тож після будь-якого коміту
+# старі записи просто перестають збігатися — окремо чистити кеш не треба.
+# Списки id лежать у SQLite-файлі поруч з індексом і спільні для всіх воркерів;
+# розібрані запити Whoosh тримаємо в пам'яті процесу, бо вони не серіалізуються.
+#
+# Влучання в кеш не пише у файл: лічильники живуть у metrics.registry, а час
+# використання для LRU копимо в пам'яті і скидаємо разом з наступним put, щоб
+# читання не чекали на єдиний лок запису SQLite.
+
+CACHE_FILE = 'SEARCH_CACHE.sqlite'
+MAX_ENTRIES = 1000
+MAX_PARSED = 256
+
+CACHE_DDL = (
+    'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, generation INTEGER NOT NULL, '
+    'ids TEXT NOT NULL, used_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_results_used_at ON results (used_at)',
+)
+
+_TOC_RE = re.compile(r'^_MAIN_(\d+)\.toc$')
+
+
+def index_generation(index_dir):
+    # Дешевше за open_dir: не читаємо TOC і схему, тільки список файлів
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return -1
+    gens = [int(m.group(1)) for m in map(_TOC_RE.match, names) if m]
+    return max(gens) if gens else -1
+
+def normalize_query(query_str):
+    # Тільки пробіли: регістр значущий для операторів Whoosh ("cats OR dogs" і
+    # "cats or dogs" — різні запити), а терми аналізатор однаково опустить сам
+    return ' '.join(query_str.split())
+
+def cache_key(query_str, filters=None, page=1):
+    # Порожні фільтри не впливають на результат, тому не роздувають ключ
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, '')}
+    return json.dumps([normalize_query(query_str), filters, page], sort_keys=True, ensure_ascii=False)
+
+
+class SearchCache:
+    def __init__(self, index_dir, max_entries=MAX_ENTRIES, max_parsed=MAX_PARSED):
+        self.index_dir = index_dir
+        self.path = os.path.join(index_dir, CACHE_FILE)
+        self._file = SqliteFile(self.path, CACHE_DDL)
+        self.max_entries = max_entries
+        self.max_parsed = max_parsed
+        self._parsed = OrderedDict()
+        self._parsed_lock = threading.Lock()
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _db(self):
+        return self._file.connect()
+
+    def _count(self, hit):
+        with self._touched_lock:
+            if hit: self._hits += 1
+            else: self._misses += 1
+        registry.inc('search_cache_hits_total' if hit else 'search_cache_misses_total')
+
+    def get(self, key, generation):
+        # Повертає список id або None, якщо в кеші нема запису для цієї генерації.
+        # Тільки читання: жодної транзакції запису на влучання
+        with self._db() as conn:
+            row = conn.execute('SELECT generation, ids FROM results WHERE key = ?', (key,)).fetchone()
+        if row and row[0] == generation:
+            with self._touched_lock:
+                self._touched[key] = time.time()
+            self._count(True)
+            return json.loads(row[1])
+        self._count(False)
+        return None
+
+    def put(self, key, generation, ids):
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        with self._db() as conn:
+            # Заразом фіксуємо, які записи читали з минулого put — від цього залежить LRU
+            conn.executemany('UPDATE results SET used_at = MAX(used_at, ?) WHERE key = ?',
+                             [(used_at, k) for k, used_at in touched.items()])
+            # Записи попередніх генерацій вже ніколи не спрацюють
+            conn.execute('DELETE FROM results WHERE generation < ?', (generation,))
+            conn.execute('INSERT OR REPLACE INTO results (key, generation, ids, used_at) VALUES (?, ?, ?, ?)',
+                         (key, generation, json.dumps(ids), time.time()))
+            # LRU: викидаємо найдавніше використані записи понад ліміт
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                         'ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def parsed(self, query_str, parse):
+        # LRU розібраних запитів у пам'яті процесу; parse — функція від рядка.
+        # Ключ — сирий рядок: будь-яка нормалізація може змінити зміст запиту
+        key = query_str
+        with self._parsed_lock:
+            if key in self._parsed:
+                self._parsed.move_to_end(key)
+                return self._parsed[key]
+        query = parse(query_str)
+        with self._parsed_lock:
+            self._parsed[key] = query
+            while len(self._parsed) > self.max_parsed:
+                self._parsed.popitem(last=False)
+        return query
+
+    def stats(self):
+        # hits/misses — цього процесу; сумарні по воркерах дивимось на /metrics
+        with self._db() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'hits': self._hits, 'misses': self._misses,
+                'entries': entries, 'parsed_entries': len(self._parsed)}
+
+    def clear(self):
+        with self._db() as conn:
+            conn.execute('DELETE FROM results')
+        with self._parsed_lock:
+            self._parsed.clear()
+        with self._touched_lock:
+            self._touched.clear()
+            self._hits = self._misses = 0
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# SQLite-файли поруч з індексом (черга змін, кеш пошуку), спільні для всіх
+# воркерів. Файл і таблиці створюємо при першому зверненні, а не в create_app.
+
+
+class SqliteFile:
+    def __init__(self, path, ddl):
+        self.path = path
+        self.ddl = ddl
+        self._ready = False
+
+    @contextmanager
+    def connect(self):
+        # Одна транзакція на блок with: коміт на виході, відкат при винятку
+        if not self._ready: os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                if not self._ready:
+                    for statement in self.ddl: conn.execute(statement)
+                    self._ready = True
+                yield conn
+        finally:
+            conn.close()
@@ -0,0 +1,92 @@
+import heapq
+import threading
+from bisect import bisect_left
+from search_cache import index_generation
+
+# Підказки для рядка пошуку.
+#
+# З лексикону Whoosh для кожного поля будуємо відсортований масив термів і
+# паралельний масив частот (у скількох документах трапляється терм). Префікс
+# шукаємо бінарним пошуком, а з діапазону беремо найчастіші. Масиви рахуємо
+# окремо для кожного сегмента індексу: після коміту додаються нові сегменти,
+# і перебудовувати треба тільки їх, а старі беремо з пам'яті.
+#
+# Заголовок і текст індексуються зі стемінгом, тож у їхньому лексиконі лежать
+# основи ("comput"). Для них беремо окреме поле spell_<поле> з цілими словами;
+# його ж використовує correct_query для "можливо, ви мали на увазі".
+
+SUGGEST_FIELDS = ('title', 'authors')
+DEFAULT_LIMIT = 8
+
+
+class Suggester:
+    def __init__(self, index_dir, fields=SUGGEST_FIELDS):
+        self.index_dir = index_dir
+        self.fields = fields
+        self.generation = None
+        self._segments = {}
+        self._terms = {f: ([], []) for f in fields}
+        self._lock = threading.Lock()
+
+    def _segment_terms(self, reader):
+        # {поле: {терм: частота}} для одного сегмента
+        terms = {}
+        for field in self.fields:
+            if field not in reader.schema: continue
+            fieldobj = reader.schema[field]
+            source = fieldobj.spelling_fieldname(field) if fieldobj.separate_spelling() else field
+            terms[field] = {t.decode('utf-8'): info.doc_frequency() for t, info in reader.iter_field(source)}
+        return terms
+
+    def refresh(self):
+        # Перебудовуємо масиви, тільки якщо з'явилася нова генерація індексу
+        generation = index_generation(self.index_dir)
+        if generation == self.generation: return False
+        with self._lock:
+            if generation == self.generation: return False
+            from whoosh.index import open_dir, exists_in
+            segments = {}
+            if exists_in(self.index_dir):
+                with open_dir(self.index_dir).reader() as reader:
+                    for leaf, _ in reader.leaf_readers():
+                        # У щойно створеного порожнього індексу сегментів ще нема
+                        if leaf.segment() is None: continue
+                        segid = leaf.segment().segid
+                        segments[segid] = self._segments.get(segid) or self._segment_terms(leaf)
+
+            merged = {}
+            for field in self.fields:
+                counts = {}
+                for seg in segments.values():
+                    for term, freq in seg.get(field, {}).items():
+                        counts[term] = counts.get(term, 0) + freq
+                keys = sorted(counts)
+                merged[field] = (keys, [counts[k] for k in keys])
+
+            self._segments = segments
+            self._terms = merged
+            self.generation = generation
+        return True
+
+    def suggest(self, prefix, field='title', limit=DEFAULT_LIMIT):
+        self.refresh()
+        prefix = prefix.strip().lower()
+        if not prefix or field not in self._terms: return []
+        keys, freqs = self._terms[field]
+        lo = bisect_left(keys, prefix)
+        # Усі терми з цим префіксом лежать поспіль, одразу за ними — вже більші рядки
+        hi = bisect_left(keys, prefix + '\uffff', lo)
+        top = heapq.nlargest(limit, range(lo, hi), key=freqs.__getitem__)
+        return [{'term': keys[i], 'count': freqs[i]} for i in top]
+
+    def did_you_mean(self, query_str):
+        # Виправлення для запиту без результатів або None, якщо виправляти нічого
+        from whoosh.index import open_dir, exists_in
+        from whoosh.qparser import MultifieldParser
+        if not exists_in(self.index_dir): return None
+        ix = open_dir(self.index_dir)
+        query = MultifieldParser(["title", "content", "authors"], ix.schema).parse(query_str)
+        with ix.searcher() as searcher:
+            corrected = searcher.correct_query(query, query_str)
+        if corrected.query == query: return None
+        return corrected.string
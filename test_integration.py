@@ -13,6 +13,7 @@ def client():
         TESTING = True
         SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
         WTF_CSRF_ENABLED = False
+        INDEX_WRITER = 'inline'
         UPLOAD_FOLDER = 'uploads_test'
         WHOOSH_BASE = 'whoosh_integration_index'  # Окрема папка для цих тестів!
 
@@ -87,4 +88,154 @@ def test_add_knowledge(client):
 
 def test_admin_access_denied(client):
     response = client.get('/admin/users')
-    assert response.status_code == 403
\ No newline at end of file
+    assert response.status_code == 403
+
+def test_search_cache_invalidated_by_upload(client):
+    cache = client.application.extensions['search_cache']
+    cache.clear()
+    client.get('/documents?q=Test')
+    client.get('/documents?q=%20Test%20%20')
+    assert cache.stats()['hits'] == 1
+
+    # Новий документ — нова генерація індексу, тож запит рахується заново
+    test_upload_document(client)
+    response = client.get('/documents?q=Test')
+    assert cache.stats()['hits'] == 1
+    assert b'Test Doc' in response.data
+
+def test_search_suggest(client):
+    # Одразу після init індекс порожній
+    response = client.get('/search/suggest?q=te&field=title')
+    assert response.status_code == 200
+    assert response.get_json()['suggestions'] == []
+
+    test_upload_document(client)
+    response = client.get('/search/suggest?q=te&field=title')
+    assert response.status_code == 200
+    assert response.get_json()['suggestions'][0]['term'] == 'test'
+
+    response = client.get('/documents?q=tesr')
+    assert b'q=test' in response.data
+
+def test_author_filter(client):
+    test_upload_document(client)
+    response = client.get('/documents?author=ivan')
+    assert b'Test Doc' in response.data
+    response = client.get('/documents?author=vanov')
+    assert b'Test Doc' not in response.data
+    response = client.get('/authors')
+    assert b'Ivanov' in response.data
+
+def test_author_suggest_then_filter(client):
+    # Підказка дає окреме слово, і фільтр за ним знаходить повне ім'я
+    client.post('/document/upload', data={'title': 'Optics', 'authors': 'Olena Petrenko', 'year': 2024, 'source': '',
+                                          'doc_type': 'стаття', 'file': (BytesIO(b"dummy"), 'o.docx')},
+                follow_redirects=True)
+    term = client.get('/search/suggest?q=petr&field=authors').get_json()['suggestions'][0]['term']
+    assert term == 'petrenko'
+    response = client.get(f'/documents?author={term}')
+    assert b'Optics' in response.data
+    response = client.get(f'/authors?q={term}')
+    assert b'Olena Petrenko' in response.data
+
+def test_metrics_endpoint(client, tmp_path):
+    # Звичайному користувачу метрики недоступні
+    assert client.get('/metrics').status_code == 403
+
+    client.get('/documents?q=something')
+    # Адміна тепер створює `flask init`, а не create_app
+    result = client.application.test_cli_runner().invoke(args=['init'])
+    assert result.exit_code == 0
+    client.get('/logout')
+    client.post('/login', data={'email': 'admin@example.com', 'password': 'admin123'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="document_list",method="GET",status="200"}' in text
+    assert 'sql_query_duration_seconds_count' in text
+    assert 'search_seconds_bucket{le="+Inf"}' in text
+    assert 'template_render_seconds_count{template="document/list.html"}' in text
+
+    # Профайлер вмикається тільки явно і тільки для адміна
+    client.application.config.update(PROFILER_ENABLED=True, PROFILE_DIR=str(tmp_path))
+    response = client.get('/documents?_profile=1')
+    assert (tmp_path / response.headers['X-Profile-File']).exists()
+
+def test_duplicate_upload_warns_and_collapses(client):
+    from docx import Document as DocxDocument
+    paragraphs = [f"Розділ {i}: вплив параметра {i} на збіжність ітераційного методу {i * 7}" for i in range(60)]
+
+    def upload(title, paras):
+        buf = BytesIO()
+        docx = DocxDocument()
+        for p in paras: docx.add_paragraph(p)
+        docx.save(buf)
+        buf.seek(0)
+        return client.post('/document/upload', data={'title': title, 'authors': 'Ivanov', 'year': 2024, 'source': '',
+                                                     'doc_type': 'стаття', 'file': (buf, f'{title}.docx')},
+                           follow_redirects=True)
+
+    assert 'Схоже, це версія'.encode() not in upload('Preprint', paragraphs).data
+    response = upload('Final', paragraphs + ["Подяки рецензентам"])
+    assert 'Схоже, це версія вже наявного документа «Preprint»'.encode() in response.data
+
+    preprint = Document.query.filter_by(title='Preprint').one()
+    assert b'Final' in client.get(f'/document/{preprint.id}').data
+
+    collapsed = client.get('/documents?q=збіжність&collapse=1').data
+    assert collapsed.count(b'/download') == 1 and b'+1' in collapsed
+    assert client.get(f'/documents?cluster={preprint.id}').data.count(b'/download') == 2
+
+def test_bulk_endpoint_and_document_delete(client):
+    from models import Knowledge, Collection, CollectionItem
+    doc = Document(title='Bulk', original_filename='b.pdf', stored_filename='b.pdf', uploaded_by=1)
+    col = Collection(name='Col', user_id=1)
+    db.session.add_all([doc, col])
+    db.session.flush()
+    notes = [Knowledge(document_id=doc.id, user_id=1, text=f'n{i}') for i in range(5)]
+    db.session.add_all(notes)
+    db.session.commit()
+    ids = [str(k.id) for k in notes]
+
+    response = client.post('/knowledge/bulk', data={'action': 'add_to_collection', 'collection_id': col.id,
+                                                    'knowledge_ids': ids})
+    assert response.get_json() == {'action': 'add_to_collection', 'count': 5}
+    assert client.post('/knowledge/bulk', data={'action': 'nope'}).status_code == 400
+
+    # Видалення документа прибирає і нотатки, і їхні місця в колекціях
+    client.post(f'/document/{doc.id}/delete')
+    assert Knowledge.query.count() == 0 and CollectionItem.query.count() == 0
+
+def test_local_cache_invalidation(client):
+    from flask import g
+    from sqlalchemy import event
+    queries = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(1))
+
+    # Фікстура тримає один app context, тож flask-login запам'ятовує юзера в g —
+    # прибираємо його, щоб кожен запит справді проходив через load_user
+    client.get('/')
+    g.pop('_login_user', None)
+    client.get('/')
+    g.pop('_login_user', None)
+    del queries[:]
+    # Юзер, нові надходження і "ви переглядали" вже в кеші, і HTML цих блоків теж
+    assert client.get('/').status_code == 200
+    assert queries == []
+
+    client.post('/document/upload', data={'title': 'Fresh Doc', 'authors': 'Ivanov', 'year': 2025, 'source': '',
+                                          'doc_type': 'стаття', 'file': (BytesIO(b"dummy"), 'f.docx')})
+    doc = Document.query.filter_by(title='Fresh Doc').one()
+    assert b'Fresh Doc' in client.get('/').data
+    client.get(f'/document/{doc.id}')
+    assert client.get('/').data.count(b'Fresh Doc') == 2
+
+    # Блокування адміном скидає закешованого юзера, не чекаючи TTL
+    cache = client.application.extensions['local_cache']
+    assert cache.get(('user', 1)).is_active is True
+    client.application.test_cli_runner().invoke(args=['init'])
+    client.get('/logout')
+    client.post('/login', data={'email': 'admin@example.com', 'password': 'admin123'})
+    client.post('/admin/user/1/toggle')
+    assert cache.get(('user', 1)) is None
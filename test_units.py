@@ -14,6 +14,7 @@ def app_context():
         TESTING = True
         SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # БД в оперативній пам'яті
         WTF_CSRF_ENABLED = False
+        INDEX_WRITER = 'inline'
         WHOOSH_BASE = 'whoosh_test_index'
 
     app = create_app(TestConfig)
@@ -24,6 +25,10 @@ def app_context():
         db.session.remove()
         db.drop_all()
 
+    import shutil
+    if os.path.exists('whoosh_test_index'):
+        shutil.rmtree('whoosh_test_index')
+
 # --- ТЕСТ 1: Перевірка хешування паролів ---
 def test_password_hashing(app_context):
     u = User(name="TestUser", email="test@example.com")
@@ -72,4 +77,381 @@ def test_index_initialization(app_context):
     
     import shutil
     if os.path.exists(index_dir):
-        shutil.rmtree(index_dir)
\ No newline at end of file
+        shutil.rmtree(index_dir)
+
+# --- ТЕСТ 5: Злиття сегментів індексу ---
+def test_merge_segments(tmp_path):
+    from utils import init_search_index
+    from index_maintenance import index_writer, merge_segments, segment_count
+    from whoosh.writing import NO_MERGE
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    for i in range(3):
+        with index_writer(index_dir, mergetype=NO_MERGE) as writer:
+            writer.add_document(id=str(i), title=f"Doc {i}", content="text")
+
+    assert segment_count(index_dir) == 3
+    assert merge_segments(index_dir) == (3, 1)
+
+# --- ТЕСТ 6: Звірка БД з індексом ---
+def test_reconcile_index(app_context, tmp_path):
+    from utils import init_search_index
+    from index_maintenance import index_writer, reconcile_index, indexed_ids
+    from models import Document
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    doc = Document(title="В БД, але не в індексі", original_filename="a.docx", stored_filename="a.docx")
+    db.session.add(doc)
+    db.session.commit()
+    with index_writer(index_dir) as writer:
+        writer.add_document(id="999", title="Сирота", content="text")
+
+    report = reconcile_index(index_dir, str(tmp_path), repair=True)
+    assert report['missing'] == [doc.id]
+    assert report['orphans'] == [999]
+    assert indexed_ids(index_dir) == {str(doc.id)}
+    # Ремонт пройшов через чергу і нічого в ній не лишив
+    from index_queue import IndexQueue
+    assert IndexQueue(index_dir).applied_seq() == 2
+    assert IndexQueue(index_dir).pending()[0] == 0
+
+# --- ТЕСТ 7: Лок знімається тільки з мертвого власника або після протухання чужого лізингу ---
+def test_recover_stale_lock(tmp_path):
+    import json
+    import time
+    import subprocess
+    import sys
+    from utils import init_search_index
+    from index_maintenance import recover_stale_lock, write_lease, read_lease, LEASE_FILE
+    from whoosh.filedb.filestore import FileStorage
+    from whoosh.index import open_dir, LockError
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    lock = FileStorage(index_dir).lock('MAIN_WRITELOCK')
+    assert lock.acquire(blocking=False)
+    write_lease(index_dir)
+
+    # Власник живий і лізинг свіжий — не чіпаємо
+    assert recover_stale_lock(index_dir) is False
+    assert read_lease(index_dir) is not None
+
+    def rewrite_lease(**changes):
+        lease = dict(read_lease(index_dir), **changes)
+        with open(tmp_path / 'ix' / LEASE_FILE, 'w') as f:
+            json.dump(lease, f)
+
+    # Старий лізинг живого процесу на цьому ж хості (довге злиття) — теж не чіпаємо
+    rewrite_lease(acquired_at=time.time() - 3600)
+    assert recover_stale_lock(index_dir) is False
+
+    # Лізинг мертвого процесу, а лок тримає живий (писар, що ще не записав свій
+    # лізинг): прибираємо тільки лізинг, другий writer лок не отримує
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    rewrite_lease(pid=dead.pid, acquired_at=time.time())
+    assert recover_stale_lock(index_dir) is False
+    assert read_lease(index_dir) is None
+    assert os.path.exists(tmp_path / 'ix' / 'MAIN_WRITELOCK')
+    with pytest.raises(LockError):
+        open_dir(index_dir).writer(timeout=0.1)
+
+    # Лок вільний, лишився тільки лізинг мертвого процесу — прибираємо
+    lock.release()
+    write_lease(index_dir)
+    rewrite_lease(pid=dead.pid)
+    assert recover_stale_lock(index_dir) is True
+    assert read_lease(index_dir) is None
+
+    # Власник на іншому хості: свіжий лізинг поважаємо, протухлий — ні
+    lock = FileStorage(index_dir).lock('MAIN_WRITELOCK')
+    assert lock.acquire(blocking=False)
+    write_lease(index_dir)
+    rewrite_lease(host='other-host')
+    assert recover_stale_lock(index_dir) is False
+    rewrite_lease(acquired_at=time.time() - 3600)
+    assert recover_stale_lock(index_dir) is True
+
+# --- ТЕСТ 8: Черга індексу зливає зміни в один коміт ---
+def test_index_queue_group_commit(tmp_path):
+    from types import SimpleNamespace
+    from utils import init_search_index, search_fulltext
+    from index_queue import IndexQueue
+    from whoosh.index import open_dir
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    queue = IndexQueue(index_dir)
+    generation = open_dir(index_dir).latest_generation()
+
+    a = SimpleNamespace(id=1, title="Квантова оптика", authors="Petrenko", year=2020)
+    b = SimpleNamespace(id=2, title="Квантова хімія", authors="Ivanenko", year=2021)
+    queue.add(a, str(tmp_path / 'a.docx'))
+    queue.add(b, str(tmp_path / 'b.docx'))
+    queue.delete(2)
+
+    assert queue.drain() == 3
+    assert open_dir(index_dir).latest_generation() == generation + 1
+    assert search_fulltext("Квантова", index_dir) == [1]
+    assert queue.pending()[0] == 0
+
+# --- ТЕСТ 9: Read-your-writes через фоновий писар ---
+def test_index_queue_read_your_writes(tmp_path):
+    from types import SimpleNamespace
+    from utils import init_search_index, search_fulltext
+    from index_queue import IndexQueue
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    queue = IndexQueue(index_dir, max_delay=0.05)
+    queue.start()
+    try:
+        seq = queue.add(SimpleNamespace(id=7, title="Нейромережі", authors="", year=None), str(tmp_path / 'n.pdf'))
+        assert queue.wait_for(seq, timeout=5) is True
+        assert search_fulltext("Нейромережі", index_dir) == [7]
+    finally:
+        queue.stop()
+
+# --- ТЕСТ 10: Кеш пошуку скидається зі зміною генерації індексу ---
+def test_search_cache_generation_and_lru(tmp_path):
+    from search_cache import SearchCache, cache_key
+
+    cache = SearchCache(str(tmp_path), max_entries=2)
+    key = cache_key("  Квантова   ОПТИКА ", {'author': '', 'year_from': 2020})
+    assert key == cache_key("Квантова ОПТИКА", {'year_from': 2020})
+    # Регістр операторів змінює запит, тож і ключ
+    assert cache_key("cats OR dogs") != cache_key("cats or dogs")
+
+    cache.put(key, 5, [3, 1])
+    assert cache.get(key, 5) == [3, 1]
+    assert cache.get(key, 6) is None
+
+    cache.put(cache_key("a"), 6, [1])
+    cache.put(cache_key("b"), 6, [2])
+    cache.get(cache_key("a"), 6)
+    cache.put(cache_key("c"), 6, [3])
+    # "b" використовували найдавніше — його і витіснило
+    assert cache.get(cache_key("b"), 6) is None
+    assert cache.get(cache_key("a"), 6) == [1]
+    assert cache.stats()['hits'] == 3
+
+    # Влучання тільки читають файл кешу
+    before = os.stat(cache.path).st_mtime_ns
+    cache.get(cache_key("a"), 6)
+    assert os.stat(cache.path).st_mtime_ns == before
+
+# --- ТЕСТ 10а: Розібраний "cats OR dogs" не підміняє "cats or dogs" ---
+def test_search_cache_keeps_operator_case(tmp_path):
+    from utils import init_search_index, search_fulltext
+    from index_maintenance import index_writer
+    from search_cache import SearchCache
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    with index_writer(index_dir) as writer:
+        writer.add_document(id='1', title='cats', content='', authors='', year='', path='')
+        writer.add_document(id='2', title='dogs', content='', authors='', year='', path='')
+    cache = SearchCache(index_dir)
+    assert sorted(search_fulltext('cats OR dogs', index_dir, cache=cache)) == [1, 2]
+    assert search_fulltext('cats or dogs', index_dir, cache=cache) == []
+
+# --- ТЕСТ 11: Підказки за префіксом і часткова перебудова ---
+def test_suggester_prefix_and_incremental(tmp_path):
+    from utils import init_search_index
+    from index_maintenance import index_writer
+    from suggest import Suggester
+    from whoosh.writing import NO_MERGE
+
+    index_dir = str(tmp_path / 'ix')
+    init_search_index(index_dir)
+    # Порожній індекс одразу після init — без сегментів
+    assert Suggester(index_dir).suggest("кван") == []
+    with index_writer(index_dir, mergetype=NO_MERGE) as writer:
+        writer.add_document(id="1", title="Квантова оптика", authors="Petrenko Ivan", content="")
+        writer.add_document(id="2", title="Квантова хімія", authors="Petrov Oleh", content="")
+
+    suggester = Suggester(index_dir)
+    assert suggester.suggest("Кван") == [{'term': 'квантова', 'count': 2}]
+    assert [s['term'] for s in suggester.suggest("pet", field='authors')] == ['petrenko', 'petrov']
+    first_segments = dict(suggester._segments)
+
+    with index_writer(index_dir, mergetype=NO_MERGE) as writer:
+        writer.add_document(id="3", title="Квантові обчислення", authors="Petrenko", content="")
+    assert suggester.suggest("petrenko", field='authors') == [{'term': 'petrenko', 'count': 2}]
+    # Старий сегмент не перераховували
+    for segid, terms in first_segments.items():
+        assert suggester._segments[segid] is terms
+
+# --- ТЕСТ 11a: Підказки і виправлення цілими словами, а не основами ---
+def test_suggester_unstemmed_words(tmp_path):
+    from whoosh.index import create_in
+    from whoosh.fields import Schema, TEXT, ID
+    from whoosh.analysis import StemmingAnalyzer
+    from utils import init_search_index
+    from suggest import Suggester
+
+    # Індекс зі старою схемою, без полів spell_*: init переписує його за новою
+    index_dir = str(tmp_path)
+    old = Schema(id=ID(stored=True, unique=True), title=TEXT(stored=True, analyzer=StemmingAnalyzer()),
+                 content=TEXT(stored=True, analyzer=StemmingAnalyzer()), authors=TEXT(stored=True))
+    writer = create_in(index_dir, old).writer()
+    writer.add_document(id="1", title="Computing networks", authors="Petrenko", content="distributed computing")
+    writer.commit()
+    init_search_index(index_dir)
+
+    suggester = Suggester(index_dir)
+    assert suggester.suggest("comp") == [{'term': 'computing', 'count': 1}]
+    assert suggester.did_you_mean("computng netwrks") == "computing networks"
+
+# --- ТЕСТ 12: Розбір авторів і лічильники документів ---
+def test_document_authors(app_context):
+    from models import Document, Author, split_authors
+
+    assert split_authors("Іваненко І.; Petrenko O., petrenko o and Smith") == ["Іваненко І.", "Petrenko O.", "Smith"]
+    assert split_authors("Smith, J., Doe, A. B.; Kovalenko, O.-M.") == ["Smith J.", "Doe A. B.", "Kovalenko O.-M."]
+
+    doc = Document(title="A", original_filename="a.pdf", stored_filename="a.pdf")
+    db.session.add(doc)
+    Author.refresh_counts(doc.set_authors("Petrenko O., Smith J."))
+    db.session.commit()
+    assert Author.query.filter_by(sort_key="petrenko o").one().document_count == 1
+
+    Author.refresh_counts(doc.set_authors("Petrenko O."))
+    db.session.commit()
+    assert [a.name for a in Author.query.all()] == ["Petrenko O."]
+    assert Document.query.filter(Document.author_list.any(Author.prefix_filter("petr"))).count() == 1
+    assert Document.query.filter(Document.author_list.any(Author.prefix_filter("enko"))).count() == 0
+    # Префікс будь-якого слова імені, а не тільки початку
+    Author.refresh_counts(doc.set_authors("Olena Petrenko"))
+    db.session.commit()
+    assert Document.query.filter(Document.author_list.any(Author.prefix_filter("petrenko"))).count() == 1
+    assert Document.query.filter(Document.author_list.any(Author.prefix_filter("o petr"))).count() == 1
+    assert Document.query.filter(Document.author_list.any(Author.prefix_filter("ivan petr"))).count() == 0
+
+# --- ТЕСТ 13: Бенчмарки проходять на крихітному корпусі і ловлять регресію ---
+def test_benchmark_smoke(tmp_path):
+    from benchmarks.run import run_benchmarks, compare
+
+    tiny = dict(users=2, docs=6, files=2, authors=4, notes=30, collections=1, items=3, views=10)
+    results = run_benchmarks('small', iterations=2, only=['route:documents', 'utils:search'],
+                             workdir=str(tmp_path), **tiny)
+    scenario = results['scenarios']['route:documents']
+    assert set(scenario) >= {'p50_ms', 'p95_ms', 'throughput_ops', 'queries_mean', 'peak_memory_kb'}
+    assert results['meta']['corpus']['docs'] == 6
+    assert results['meta']['corpus']['authors'] == 4
+    # Фільтр за прізвищем знаходить документи, а не міряє порожню сторінку
+    assert results['scenarios']['route:documents_author']['queries_mean'] > 1
+
+    slower = {'scenarios': {'route:documents': dict(scenario, queries_mean=scenario['queries_mean'] / 2)}}
+    assert compare(results, slower)[0][:2] == ('route:documents', 'queries_mean')
+    assert compare(results, results) == []
+    assert compare(results, slower, metrics=['p95_ms']) == []
+
+# --- ТЕСТ 14: Гістограми у форматі Prometheus і облік збоїв екстракції ---
+def test_metrics_registry(tmp_path):
+    from metrics import Metrics, registry
+
+    m = Metrics()
+    m.observe('latency_seconds', 0.003, endpoint='x')
+    m.observe('latency_seconds', 2.0, endpoint='x')
+    text = m.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{endpoint="x",le="0.005"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="x",le="+Inf"} 2' in text
+
+    broken = tmp_path / "broken.docx"
+    broken.write_bytes(b"not a zip")
+    before = registry.value('extract_text_failures_total', ext='.docx')
+    assert extract_text(str(broken)) == ""
+    assert registry.value('extract_text_failures_total', ext='.docx') == before + 1
+
+# --- ТЕСТ 15: MinHash/LSH знаходить іншу версію тексту і об'єднує кластери ---
+def test_near_duplicates(app_context):
+    import random
+    from models import DocumentSignature
+    from dedup import minhash, similarity, register_document, similar_documents, forget_document
+
+    rng = random.Random(7)
+    vocab = [f"слово{i}" for i in range(500)]
+    paper = [rng.choice(vocab) for _ in range(2000)]
+    # "Фінальна версія": ті самі слова, але змінений абзац на початку і дописаний кінець
+    final = ["анотація"] * 30 + paper[30:] + [rng.choice(vocab) for _ in range(60)]
+    other = [rng.choice(vocab) for _ in range(2000)]
+
+    assert minhash("") is None
+    assert similarity(minhash(" ".join(paper)), minhash(" ".join(paper))) == 1.0
+    assert similarity(minhash(" ".join(paper)), minhash(" ".join(other))) < 0.2
+
+    assert register_document(1, " ".join(paper)) == []
+    assert register_document(2, " ".join(other)) == []
+    matches = register_document(3, " ".join(final))
+    assert [m[0] for m in matches] == [1] and matches[0][1] >= 0.8
+    db.session.commit()
+
+    assert db.session.get(DocumentSignature, 3).cluster_id == 1
+    assert [m[0] for m in similar_documents(1)] == [3]
+    forget_document(3)
+    assert similar_documents(1) == []
+
+# --- ТЕСТ 16: Масові дії з нотатками — набором, з підрахунком і перевіркою прав ---
+def test_bulk_knowledge_actions(app_context):
+    from sqlalchemy import event
+    from models import Knowledge, Collection, CollectionItem
+    import bulk
+
+    mine = [Knowledge(user_id=1, text=f"n{i}") for i in range(300)]
+    foreign = Knowledge(user_id=2, text="чужа")
+    a, b, theirs = Collection(name="A", user_id=1), Collection(name="B", user_id=1), Collection(name="C", user_id=2)
+    db.session.add_all(mine + [foreign, a, b, theirs])
+    db.session.commit()
+    ids = [k.id for k in mine] + [foreign.id]
+    a, b, theirs = a.id, b.id, theirs.id
+
+    queries = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(1))
+    assert bulk.add_to_collection(1, a, ids) == 300
+    assert len(queries) == 1
+    # Повторне додавання відсікає унікальний індекс, а в чужу колекцію не додається нічого
+    assert bulk.add_to_collection(1, a, ids[:10]) == 0
+    assert bulk.add_to_collection(1, theirs, ids) == 0
+
+    assert bulk.move_between_collections(1, a, b, ids[:50]) == 50
+    assert bulk.remove_from_collection(1, b, ids[:20]) == 20
+    assert bulk.retag(1, ids[:5], " метод ,, огляд ") == 5
+    assert bulk.delete_notes(1, ids[:100]) == 100
+    db.session.commit()
+
+    assert CollectionItem.query.filter_by(collection_id=a).count() == 200
+    assert CollectionItem.query.filter_by(collection_id=b).count() == 0
+    assert Knowledge.query.count() == 201 and db.session.get(Knowledge, foreign.id) is not None
+
+# --- ТЕСТ 17: Кеш процесу — TTL, скидання за префіксом, захист від гонки зі скиданням ---
+def test_local_cache(monkeypatch):
+    import local_cache
+    from local_cache import LocalCache
+
+    now = [100.0]
+    monkeypatch.setattr(local_cache.time, 'monotonic', lambda: now[0])
+    cache = LocalCache(ttl=10)
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+
+    assert cache.get_or_set(('user', 1), compute) == 1
+    assert cache.get_or_set(('user', 1), compute) == 1
+    now[0] += 11
+    assert cache.get_or_set(('user', 1), compute) == 2
+
+    cache.set(('user', 1, 'nav', 'html'), '<nav>')
+    cache.set(('user', 2), 'other')
+    cache.invalidate('user', 1)
+    assert cache.get(('user', 1)) is None and cache.get(('user', 1, 'nav', 'html')) is None
+    assert cache.get(('user', 2)) == 'other'
+
+    # Значення, пораховане до скидання, в кеш не потрапляє
+    def stale():
+        cache.invalidate('recent_uploads')
+        return 'stale'
+    assert cache.get_or_set(('recent_uploads',), stale) == 'stale'
+    assert cache.get(('recent_uploads',)) is None
@@ -1,87 +1,88 @@
 import os
-from pypdf import PdfReader
-from docx import Document as DocxDocument
-from whoosh.index import create_in, open_dir, exists_in
-from whoosh.fields import Schema, TEXT, ID
-from whoosh.qparser import MultifieldParser
-from whoosh.analysis import StemmingAnalyzer
+import json
+import time
 import shutil
+import logging
 from datetime import datetime
-from models import db, Document
+from index_maintenance import recover_stale_lock, upgrade_schema, LEASE_SECONDS
+from metrics import registry
+
+extract_log = logging.getLogger('cw.extract')
+
+# pypdf, python-docx і Whoosh імпортуємо всередині функцій: вони потрібні
+# тільки для екстракції та пошуку, а не для кожного старту воркера
 
 def get_schema():
+    from whoosh.fields import Schema, TEXT, ID
+    from whoosh.analysis import StemmingAnalyzer
     analyzer = StemmingAnalyzer()
     return Schema(
         id=ID(stored=True, unique=True),
-        title=TEXT(stored=True, analyzer=analyzer),
-        content=TEXT(stored=True, analyzer=analyzer),
+        # spelling=True додає поля spell_title/spell_content з нестемованими словами:
+        # з них беруться підказки і "можливо, ви мали на увазі"
+        title=TEXT(stored=True, analyzer=analyzer, spelling=True),
+        content=TEXT(stored=True, analyzer=analyzer, spelling=True),
         authors=TEXT(stored=True),
         year=ID(stored=True),
         path=ID(stored=True)
     )
 
-def init_search_index(index_dir='whoosh_index'):
-    if not os.path.exists(index_dir):
-        os.mkdir(index_dir)
+def init_search_index(index_dir='whoosh_index', lease_seconds=LEASE_SECONDS):
+    from whoosh.index import create_in, exists_in
+    if not exists_in(index_dir):
+        # Папка може вже існувати: черга і кеш пошуку лежать поруч з індексом
+        os.makedirs(index_dir, exist_ok=True)
         create_in(index_dir, get_schema())
     else:
-        if exists_in(index_dir):
-            try:
-                from whoosh.index import unlock_dir
-                unlock_dir(index_dir)
-            except: pass
-
-def index_document(doc_id, filepath, index_dir='whoosh_index'):
-    if not os.path.exists(index_dir):
-        init_search_index(index_dir)
+        # Знімаємо лок тільки якщо його власник точно мертвий або лізинг протух
+        recover_stale_lock(index_dir, lease_seconds)
+        upgrade_schema(index_dir)
 
-    ix = open_dir(index_dir)
-    writer = ix.writer()
-    text = extract_text(filepath)
-    
-    doc = db.session.get(Document, doc_id)
-    
-    if doc:
-        writer.update_document(
-            id=str(doc_id),
-            title=doc.title,
-            content=text,
-            authors=doc.authors or "",
-            year=str(doc.year) if doc.year else "",
-            path=filepath
-        )
-        writer.commit()
-
-def delete_document_from_index(doc_id, index_dir='whoosh_index'):
-    if exists_in(index_dir):
-        ix = open_dir(index_dir)
-        writer = ix.writer()
-        writer.delete_by_term('id', str(doc_id))
-        writer.commit()
+def document_fields(doc, filepath, with_content=True):
+    fields = dict(
+        id=str(doc.id),
+        title=doc.title,
+        authors=doc.authors or "",
+        year=str(doc.year) if doc.year else "",
+        path=filepath
+    )
+    if with_content:
+        fields['content'] = extract_text(filepath)
+    return fields
 
-def search_fulltext(query_str, index_dir='whoosh_index'):
+def search_fulltext(query_str, index_dir='whoosh_index', page=1, cache=None):
+    from whoosh.index import open_dir, exists_in
+    from whoosh.qparser import MultifieldParser
     if not exists_in(index_dir): return []
     ix = open_dir(index_dir)
-    with ix.searcher() as searcher:
-        query = MultifieldParser(["title", "content", "authors"], ix.schema).parse(query_str)
-        results = searcher.search(query, limit=20)
+    parser = MultifieldParser(["title", "content", "authors"], ix.schema)
+    with ix.searcher() as searcher, registry.timer('search_seconds'):
+        # Розібрані запити беремо з кешу, якщо він є (див. search_cache.py)
+        query = cache.parsed(query_str, parser.parse) if cache else parser.parse(query_str)
+        results = searcher.search_page(query, page, pagelen=20)
         return [int(r['id']) for r in results]
 
 def extract_text(filepath):
     text = ""
     ext = os.path.splitext(filepath)[1].lower()
+    started = time.perf_counter()
     try:
         if ext == '.pdf':
+            from pypdf import PdfReader
             with open(filepath, 'rb') as f:
                 reader = PdfReader(f)
                 for page in reader.pages:
                     text += page.extract_text() + "\n"
         elif ext == '.docx':
+            from docx import Document as DocxDocument
             doc = DocxDocument(filepath)
             for para in doc.paragraphs:
                 text += para.text + "\n"
     except Exception as e:
-        print(f"Error extracting text: {e}")
+        registry.inc('extract_text_failures_total', ext=ext)
+        extract_log.warning(json.dumps({'event': 'extract_text_failed', 'path': filepath, 'ext': ext,
+                                        'error': f'{type(e).__name__}: {e}'}, ensure_ascii=False))
+    registry.observe('extract_text_seconds', time.perf_counter() - started, ext=ext)
     return text[:900000]
 
 def backup_database():
@@ -89,6 +90,7 @@ def backup_database():
     src = 'instance/knowledge.db'
     dst = f'backups/knowledge_{timestamp}.db'
     if os.path.exists(src):
+        os.makedirs('backups', exist_ok=True)
         shutil.copy2(src, dst)
         return dst
     return None
\ No newline at end of file